@@ -1,19 +1,111 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import heapq
+import random
 from apscheduler.schedulers.background import BackgroundScheduler
+from intents import classify_message
+import click
 import json
+import secrets
 import time
 import os
+import sqlite3
+import zlib
+
+try:
+    import fcntl
+except ImportError:   # Windows dev machines
+    fcntl = None
+import threading
+import queue
+import atexit
+import logging
+import logging.handlers
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from gspread.utils import rowcol_to_a1
 
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# ============================================================
+#                     LOGGING
+# ============================================================
+
+# Log lines are JSON objects, e.g.
+#   {"ts": "...", "level": "INFO", "event": "message_handled", "phone": "91...", "ms": 12.3}
+# Once start_log_listener() runs (from start_background_services), records
+# go on a queue and a background thread writes them, so a slow stdout or
+# log pipe never holds up a request. Before that they are written inline.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Share of delivery / read callbacks that are logged (they outnumber messages)
+LOG_CALLBACK_SAMPLE = float(os.environ.get("LOG_CALLBACK_SAMPLE", 0.01))
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "event": record.msg,
+            "pid": record.process,
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+log = logging.getLogger("app5")
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+
+_log_output = logging.StreamHandler(sys.stdout)
+_log_output.setFormatter(JsonFormatter())
+log.addHandler(_log_output)
+
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, _log_output)
+_log_listener_started = False
+
+
+def start_log_listener():
+    global _log_listener_started
+
+    if _log_listener_started:
+        return
+
+    _log_listener_started = True
+    log_listener.start()
+    # One assignment, so no record is dropped or written twice meanwhile
+    log.handlers = [logging.handlers.QueueHandler(log_queue)]
+
+
+def stop_log_listener():
+    # Registered first so it runs last at exit, after the other shutdown
+    # hooks have logged
+    if _log_listener_started:
+        log.handlers = [_log_output]
+        log_listener.stop()
+
+
+atexit.register(stop_log_listener)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    # Fields are serialized on the listener thread, not here
+    if log.isEnabledFor(level):
+        log.log(level, event, extra={"fields": fields})
+
 # ============================================================
 #                     GUPSHUP CONFIG
 # ============================================================
@@ -22,9 +114,29 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 GUPSHUP_APP_NAME = "LifestyleShauryaFitnessBot"
 GUPSHUP_SOURCE_NUMBER = "919911426467"
 GUPSHUP_SEND_URL = "https://api.gupshup.io/wa/api/v1/msg"
+GUPSHUP_TEMPLATE_URL = "https://api.gupshup.io/wa/api/v1/template/msg"
 GUPSHUP_API_KEY = os.environ.get("GUPSHUP_API_KEY")
 OWNER_NUMBER = os.environ.get("OWNER_NUMBER")
 
+# (connect, read) timeouts in seconds for every Gupshup call
+GUPSHUP_TIMEOUT = (
+    float(os.environ.get("GUPSHUP_CONNECT_TIMEOUT", 3.05)),
+    float(os.environ.get("GUPSHUP_READ_TIMEOUT", 10))
+)
+GUPSHUP_MAX_RETRIES = int(os.environ.get("GUPSHUP_MAX_RETRIES", 2))
+GUPSHUP_POOL_SIZE = int(os.environ.get("GUPSHUP_POOL_SIZE", 20))
+
+# Background threads that deliver owner alerts; replies to leads are sent
+# by the inbound workers, see INBOUND QUEUES
+OUTBOUND_WORKERS = int(os.environ.get("OUTBOUND_WORKERS", 4))
+
+# Image albums: how many images of one album may be in flight at once, and
+# the gap between their start times that keeps them arriving in order.
+# MEDIA_CONCURRENCY=1 sends each image only after the previous one is acked.
+MEDIA_CONCURRENCY = int(os.environ.get("MEDIA_CONCURRENCY", 3))
+MEDIA_STAGGER_MS = int(os.environ.get("MEDIA_STAGGER_MS", 150))
+MEDIA_POOL_SIZE = int(os.environ.get("MEDIA_POOL_SIZE", 8))
+
 
 # ============================================================
 #                     GYM CONFIG
@@ -109,6 +221,337 @@ GYM_IMAGES = [
 ]
 
 
+# ============================================================
+#                     LOCAL DATABASE
+# ============================================================
+
+# SQLite file shared by every gunicorn worker on this machine
+DATA_DB_PATH = os.environ.get("DATA_DB_PATH", "leads.db")
+
+
+def open_db(path=DATA_DB_PATH):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# ============================================================
+#                     METRICS
+# ============================================================
+
+# Each worker adds its counts to the shared SQLite file this often, so
+# /metrics on any worker shows the totals of all of them.
+METRICS_FLUSH_SECONDS = int(os.environ.get("METRICS_FLUSH_SECONDS", 10))
+
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{inner}}}"
+
+
+class Metrics:
+    # Prometheus counters and duration histograms. Updates only touch an
+    # in-memory dict; flush() adds them to the shared table.
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.pending = {}    # (family, series) -> value to add
+        self.families = {}   # family -> (type, help)
+        self.conn = open_db(path)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics "
+                "(series TEXT PRIMARY KEY, family TEXT NOT NULL, value REAL NOT NULL)"
+            )
+
+    def describe(self, family, kind, help_text):
+        self.families[family] = (kind, help_text)
+
+    def _add(self, family, series, value):
+        key = (family, series)
+        self.pending[key] = self.pending.get(key, 0) + value
+
+    def inc(self, family, value=1, **labels):
+        with self.lock:
+            self._add(family, _series(family, labels), value)
+
+    def observe(self, family, seconds, **labels):
+        with self.lock:
+            for bound in METRIC_BUCKETS:
+                if seconds <= bound:
+                    self._add(family, _series(f"{family}_bucket", dict(labels, le=bound)), 1)
+            self._add(family, _series(f"{family}_bucket", dict(labels, le="+Inf")), 1)
+            self._add(family, _series(f"{family}_sum", labels), seconds)
+            self._add(family, _series(f"{family}_count", labels), 1)
+
+    @contextmanager
+    def timer(self, family, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(family, time.perf_counter() - started, **labels)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        if not pending:
+            return
+
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO metrics (series, family, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (series) DO UPDATE SET value = value + excluded.value",
+                    [(series, family, value) for (family, series), value in pending.items()]
+                )
+        except Exception as e:
+            log_event("metrics_flush_failed", logging.ERROR, error=str(e))
+            with self.lock:
+                for key, value in pending.items():
+                    self.pending[key] = self.pending.get(key, 0) + value
+
+    def render(self):
+        self.flush()
+
+        with self.lock:
+            rows = self.conn.execute("SELECT family, series, value FROM metrics ORDER BY family, series").fetchall()
+
+        lines = []
+        current = None
+
+        for family, series, value in rows:
+            if family != current:
+                current = family
+                kind, help_text = self.families.get(family, ("untyped", ""))
+                lines.append(f"# HELP {family} {help_text}")
+                lines.append(f"# TYPE {family} {kind}")
+            lines.append(f"{series} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(DATA_DB_PATH)
+metrics.describe("sheets_requests_total", "counter", "Google Sheets API calls by operation and status")
+metrics.describe("sheets_request_seconds", "histogram", "Google Sheets API call duration")
+metrics.describe("gupshup_requests_total", "counter", "Gupshup API calls by endpoint and HTTP status")
+metrics.describe("gupshup_request_seconds", "histogram", "Gupshup API call duration")
+metrics.describe("process_message_seconds", "histogram", "Time to handle one inbound message")
+metrics.describe("find_row_seconds", "histogram", "find_row_by_phone duration")
+metrics.describe("reminder_checker_seconds", "histogram", "Duration of one reminder_checker run")
+metrics.describe("reminders_sent_total", "counter", "Reminder and review templates sent by kind")
+metrics.describe("reminders_failed_total", "counter", "Reminder and review templates given up on after retries")
+metrics.describe("campaign_messages_total", "counter", "Campaign templates by campaign and result")
+
+
+metrics.describe("sheets_retries_total", "counter", "Google Sheets calls retried after a quota / server error")
+metrics.describe("sheets_throttle_seconds", "histogram", "Time spent waiting for the Sheets rate limiter")
+
+
+# ============================================================
+#                  SHEETS RATE LIMITING
+# ============================================================
+
+# Google allows about 60 read and 60 write requests per minute per user.
+# Both budgets are shared by all workers. Background jobs (reminders,
+# scans, campaigns) may not dip into the last SHEETS_BACKGROUND_RESERVE of
+# a budget, which is kept for webhook traffic.
+SHEETS_READS_PER_MINUTE = int(os.environ.get("SHEETS_READS_PER_MINUTE", 60))
+SHEETS_WRITES_PER_MINUTE = int(os.environ.get("SHEETS_WRITES_PER_MINUTE", 60))
+SHEETS_BACKGROUND_RESERVE = float(os.environ.get("SHEETS_BACKGROUND_RESERVE", 0.25))
+SHEETS_MAX_RETRIES = int(os.environ.get("SHEETS_MAX_RETRIES", 5))
+SHEETS_BACKOFF_MAX = 32
+
+SHEETS_WRITE_CALLS = {
+    "update_cell", "update_cells", "update", "batch_update",
+    "append_row", "append_rows", "insert_row", "insert_rows", "delete_rows", "clear"
+}
+
+# Safe to repeat after a 5xx, unlike appends / inserts which may have landed
+SHEETS_IDEMPOTENT_WRITES = {"update_cell", "update_cells", "update", "batch_update"}
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+# The caller already took the write token and holds locks that messages
+# wait on: the call neither waits for a token nor backs off and retries
+PREPAID = "prepaid"
+
+_sheets_priority = threading.local()
+
+
+@contextmanager
+def sheets_priority(priority):
+    previous = getattr(_sheets_priority, "value", INTERACTIVE)
+    _sheets_priority.value = priority
+    try:
+        yield
+    finally:
+        _sheets_priority.value = previous
+
+
+class TokenBucket:
+    # Requests-per-minute budget kept in the shared SQLite file
+
+    def __init__(self, path, name, per_minute, burst=None):
+        self.name = name
+        self.capacity = float(burst if burst is not None else per_minute)
+        self.rate = per_minute / 60.0
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets "
+                "(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def try_take(self, reserve):
+        # Takes a token and returns 0, or returns how long to wait for one
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                now = time.time()
+                row = self.conn.execute(
+                    "SELECT tokens, updated FROM rate_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+
+                tokens = self.capacity if row is None else min(
+                    self.capacity, row[0] + max(now - row[1], 0) * self.rate
+                )
+
+                if tokens - 1 >= reserve:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (reserve + 1 - tokens) / self.rate
+
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                    (self.name, tokens, now)
+                )
+                self.conn.commit()
+
+            except Exception:
+                self.conn.rollback()
+                raise
+
+        return wait
+
+    def acquire(self, priority):
+        reserve = self.capacity * SHEETS_BACKGROUND_RESERVE if priority == BACKGROUND else 0
+        started = time.perf_counter()
+
+        while True:
+            wait = self.try_take(reserve)
+            if not wait:
+                break
+            time.sleep(min(wait, 1.0))
+
+        waited = time.perf_counter() - started
+        if waited > 0.001:
+            metrics.observe("sheets_throttle_seconds", waited, bucket=self.name, priority=priority)
+
+
+sheets_read_bucket = TokenBucket(DATA_DB_PATH, "sheets_read", SHEETS_READS_PER_MINUTE)
+sheets_write_bucket = TokenBucket(DATA_DB_PATH, "sheets_write", SHEETS_WRITES_PER_MINUTE)
+
+
+def sheets_retryable(name, error):
+    if error.code == 429:
+        return True
+    if error.code in (500, 502, 503):
+        return name not in SHEETS_WRITE_CALLS or name in SHEETS_IDEMPOTENT_WRITES
+    return False
+
+
+class InstrumentedWorksheet:
+    # Wraps the gspread worksheet so every API call is rate limited, retried
+    # with jittered exponential backoff on quota errors, timed and counted.
+    # The worksheet is opened on first use, not at import, so a worker boots
+    # even when Google is slow or unreachable; a failed open is retried on
+    # the next call.
+
+    def __init__(self, opener):
+        self.opener = opener
+        self.worksheet = None
+        self.lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self.worksheet is not None
+
+    def connect(self):
+        if self.worksheet is None:
+            with self.lock:
+                if self.worksheet is None:
+                    self.worksheet = self._timed("open", self.opener, (), {})
+                    log_event("sheets_connected")
+
+        return self.worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self.connect(), name)
+
+        if not callable(attr):
+            return attr
+
+        bucket = sheets_write_bucket if name in SHEETS_WRITE_CALLS else sheets_read_bucket
+
+        def call(*args, **kwargs):
+            priority = getattr(_sheets_priority, "value", INTERACTIVE)
+            retries = 0 if priority == PREPAID else SHEETS_MAX_RETRIES
+            attempt = 0
+
+            while True:
+                if priority != PREPAID:
+                    bucket.acquire(priority)
+
+                try:
+                    return self._timed(name, attr, args, kwargs)
+                except gspread.exceptions.APIError as e:
+                    if attempt >= retries or not sheets_retryable(name, e):
+                        raise
+
+                    # Truncated exponential backoff with jitter
+                    delay = min(SHEETS_BACKOFF_MAX, 2 ** attempt)
+                    delay = delay / 2 + random.uniform(0, delay / 2)
+                    attempt += 1
+
+                    metrics.inc("sheets_retries_total", op=name, status=str(e.code))
+                    log_event("sheets_retry", logging.WARNING, op=name, status=e.code, attempt=attempt, delay=round(delay, 1))
+                    time.sleep(delay)
+
+        return call
+
+    def last_update_time(self):
+        # Drive metadata for the spreadsheet; changes on every edit
+        return self._timed("get_lastUpdateTime", self.connect().spreadsheet.get_lastUpdateTime, (), {})
+
+    def _timed(self, name, attr, args, kwargs):
+        started = time.perf_counter()
+        status = "ok"
+
+        try:
+            return attr(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = str(e.code)
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            metrics.observe("sheets_request_seconds", time.perf_counter() - started, op=name)
+            metrics.inc("sheets_requests_total", op=name, status=status)
+
+
 # ============================================================
 #                    GOOGLE SHEETS SETUP
 # ============================================================
@@ -118,25 +561,716 @@ scope = [
     "https://www.googleapis.com/auth/drive"
 ]
 
-creds_dict = json.loads(os.environ.get("GOOGLE_CREDS_JSON"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
-sheet = client.open("Gym leads").sheet1
+
+
+def open_lead_sheet():
+    creds_json = os.environ.get("GOOGLE_CREDS_JSON")
+    if not creds_json:
+        raise RuntimeError("GOOGLE_CREDS_JSON is not set")
+
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(creds_json), scope)
+    client = gspread.authorize(creds)
+    return client.open("Gym leads").sheet1
+
+
+sheet = InstrumentedWorksheet(open_lead_sheet)
+
+# ============================================================
+#                     LEAD INDEX
+# ============================================================
+
+# The index is kept current by sync(), which runs every SHEET_SYNC_SECONDS
+# and reads only what may have changed:
+#   - rows below the last known one (appended by the owner or other workers)
+#   - the next SHEET_SYNC_CHUNK rows of a rolling sweep over the sheet
+# so an edit anywhere in the sheet is seen within
+# (rows / SHEET_SYNC_CHUNK) * SHEET_SYNC_SECONDS. Each pass also reads the
+# phone column and reloads the whole sheet if a row now holds another phone
+# (the owner deleted, inserted or sorted rows). Passes are skipped while the
+# spreadsheet's last update time shows nothing changed since a full sweep.
+SHEET_SYNC_SECONDS = int(os.environ.get("SHEET_SYNC_SECONDS", 30))
+SHEET_SYNC_CHUNK = int(os.environ.get("SHEET_SYNC_CHUNK", 1000))
+
+# A full download still happens this often, as a backstop
+LEAD_INDEX_MAX_AGE = int(os.environ.get("LEAD_INDEX_MAX_AGE", 3600))
+
+# A phone that is not in the index triggers a read of new rows at the bottom
+# (another worker may have appended it), but never more often than this.
+LEAD_INDEX_MISS_REFRESH = 2
+
+def lead_cells(values):
+    # The lead columns of a row, padded, for comparing rows read differently
+    values = list(values[:LEAD_COLUMNS])
+    return values + [""] * (LEAD_COLUMNS - len(values))
+
+
+class LeadIndex:
+    # In-memory copy of the lead sheet: phone -> row number, plus the row
+    # contents, kept in sync by routing every append / update through it.
+    # Sheets is always read outside the lock and the result merged under
+    # it, so lookups never wait on a (possibly throttled) background read.
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()   # one full download at a time
+        self.write_seq = 0
+        self.written = {}     # row -> write_seq of its last local write
+        self.rows = {}        # row number -> list of cell values
+        self.by_phone = {}    # phone -> row number
+        self.last_row = 1     # header is row 1
+        self.loaded_at = 0
+        self.tail_read_at = 0
+        self.sweep_next = 2        # next row the rolling sweep reads
+        self.sweep_version = None  # last update time when the sweep began
+        self.clean_version = None  # nothing changed since this one was swept
+        self.unflushed = {}        # row -> write batches not yet flushed
+        self.changes = []          # rows seen changed, until sync() hands them out
+
+    def refresh(self):
+        with self.refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        # Caller holds refresh_lock
+        with self.lock:
+            seq = self.write_seq
+
+        all_rows = self.worksheet.get_all_values()
+
+        with self.lock:
+            before = self.rows
+            self.rows = {i + 1: list(all_rows[i]) for i in range(1, len(all_rows))}
+
+            # Rows written here while the download ran are newer than it
+            kept = {row for row, s in self.written.items() if s > seq and row in before}
+            for row in kept:
+                self.rows[row] = before[row]
+
+            self.written = {row: s for row, s in self.written.items() if s > seq}
+            self.by_phone = {}
+
+            for row in sorted(self.rows):
+                values = self.rows[row]
+                phone = clean_number(values[0]) if values else ""
+                # First match wins, same as the old top-down scan
+                if phone and phone not in self.by_phone:
+                    self.by_phone[phone] = row
+
+            self.last_row = max([len(all_rows), 1] + list(kept))
+            self.loaded_at = time.time()
+            self.sweep_next = 2
+            self.sweep_version = None
+
+            self.changes.extend(
+                (row, before.get(row, []), values)
+                for row, values in self.rows.items()
+                if row not in self.unflushed and row not in kept
+                and lead_cells(before.get(row, [])) != lead_cells(values)
+            )
+
+        return all_rows
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = 0
+
+    def _ensure_fresh(self):
+        # Called without the lock. While another thread is already
+        # refreshing, the rows loaded so far are used instead of waiting.
+        if time.time() - self.loaded_at <= LEAD_INDEX_MAX_AGE:
+            return
+
+        if not self.refresh_lock.acquire(blocking=not self.loaded_at):
+            return
+
+        try:
+            if time.time() - self.loaded_at > LEAD_INDEX_MAX_AGE:
+                self._refresh()
+        finally:
+            self.refresh_lock.release()
+
+    def _touch(self, row):
+        # Caller holds the lock; marks a local write, see _refresh()
+        self.write_seq += 1
+        self.written[row] = self.write_seq
+
+    def _set_row(self, row, values):
+        # Caller holds the lock
+        old = self.rows.get(row, [])
+        self.rows[row] = values
+
+        old_phone = clean_number(old[0]) if old else ""
+        phone = clean_number(values[0]) if values else ""
+
+        if old_phone != phone:
+            if old_phone and self.by_phone.get(old_phone) == row:
+                del self.by_phone[old_phone]
+            if phone:
+                self.by_phone.setdefault(phone, row)
+
+    def read_rows(self, first, last=None):
+        # Re-reads rows first..last (or to the end of the sheet) and returns
+        # [(row, old values, new values)] for the rows that changed.
+        with self.lock:
+            end = last if last is not None else self.last_row
+            before = {row: lead_cells(self.rows.get(row, [])) for row in range(first, end + 1)}
+
+        last_col = rowcol_to_a1(1, LEAD_COLUMNS).rstrip("0123456789")
+        values = self.worksheet.get(f"A{first}:{last_col}{last or ''}")
+        if last is None:
+            last = first + len(values) - 1
+
+        changed = []
+
+        with self.lock:
+            for row in range(first, last + 1):
+                offset = row - first
+                new = lead_cells(values[offset] if offset < len(values) else [])
+                old = self.rows.get(row, [])
+
+                if row > self.last_row and not any(new):
+                    continue
+
+                # Our own writes that raced the read are newer than it
+                if row in self.unflushed or lead_cells(old) != before.get(row, lead_cells(old)):
+                    continue
+
+                if lead_cells(old) != new:
+                    # Keep any columns past the lead columns as they were
+                    self._set_row(row, new + list(old[LEAD_COLUMNS:]))
+                    changed.append((row, old, new))
+
+            self.last_row = max(self.last_row, last)
+            self.changes.extend(changed)
+
+        return changed
+
+    def read_new_rows(self):
+        with self.lock:
+            self.tail_read_at = time.time()
+            first = self.last_row + 1
+
+        return self.read_rows(first)
+
+    def sync(self):
+        # One incremental pass, see SHEET_SYNC_SECONDS. Returns every row seen
+        # changed since the last call (by this pass or by other reads) as
+        # [(row, old values, new values)].
+        version = self.worksheet.last_update_time()
+
+        if time.time() - self.loaded_at > LEAD_INDEX_MAX_AGE:
+            self.refresh()
+
+            with self.lock:
+                self.clean_version = version
+                return self._take_changes()
+
+        with self.lock:
+            if version == self.clean_version:
+                return self._take_changes()
+
+            if self.sweep_next == 2:
+                self.sweep_version = version
+
+            first = self.sweep_next
+
+        # Rows above deleted / inserted / sorted ones now hold other leads;
+        # writing by the old row numbers would land in the wrong lead's row
+        if self._phones_moved():
+            self.refresh()
+
+            with self.lock:
+                self.clean_version = version
+                return self._take_changes()
+
+        self.read_new_rows()
+
+        with self.lock:
+            last = min(first + SHEET_SYNC_CHUNK - 1, self.last_row)
+
+        if first <= last:
+            self.read_rows(first, last)
+
+        with self.lock:
+            # A sweep restarted by refresh() meanwhile starts over
+            if self.sweep_next == first:
+                self.sweep_next = last + 1
+
+                if self.sweep_next > self.last_row:
+                    self.clean_version = self.sweep_version
+                    self.sweep_next = 2
+
+            return self._take_changes()
+
+    def _phones_moved(self):
+        # Compares column A (one small read) with the index. Rows written
+        # here during the read, or still in an unflushed batch, are skipped.
+        with self.lock:
+            seq = self.write_seq
+            last = self.last_row
+
+        column = self.worksheet.get(f"A2:A{last}") if last > 1 else []
+
+        with self.lock:
+            for row in range(2, last + 1):
+                if self.written.get(row, 0) > seq or row in self.unflushed:
+                    continue
+
+                cells = column[row - 2] if row - 2 < len(column) else []
+                values = self.rows.get(row, [])
+
+                if clean_number(cells[0] if cells else "") != clean_number(values[0] if values else ""):
+                    return True
+
+        return False
+
+    def cached(self, phone):
+        # (row, values) as last read, or (None, None); never calls Sheets
+        with self.lock:
+            row = self.by_phone.get(clean_number(phone))
+            return (row, list(self.rows.get(row, []))) if row else (None, None)
+
+    def _take_changes(self):
+        changes, self.changes = self.changes, []
+        return changes
+
+    def find(self, phone):
+        phone = clean_number(phone)
+        self._ensure_fresh()
+
+        with self.lock:
+            row = self.by_phone.get(phone)
+            read_tail = row is None and time.time() - self.tail_read_at > LEAD_INDEX_MISS_REFRESH
+            if read_tail:
+                self.tail_read_at = time.time()
+
+        if read_tail:
+            self.read_new_rows()
+
+            with self.lock:
+                row = self.by_phone.get(phone)
+
+        return row
+
+    def row_values(self, row):
+        self._ensure_fresh()
+
+        with self.lock:
+            return list(self.rows.get(row, []))
+
+    def snapshot(self, refresh=False):
+        # Header + data rows, in the same shape as get_all_values()
+        if refresh:
+            return self.refresh()
+
+        self._ensure_fresh()
+
+        with self.lock:
+            rows = [[]]
+            for row in range(2, self.last_row + 1):
+                rows.append(list(self.rows.get(row, [])))
+            return rows
+
+    def update_cell(self, row, col, value):
+        buffer = getattr(_write_buffers, "current", None)
+
+        if buffer is not None:
+            # Held back from sync() until the batch is written
+            if row not in buffer.rows:
+                buffer.rows.add(row)
+                with self.lock:
+                    self.unflushed[row] = self.unflushed.get(row, 0) + 1
+
+            buffer.add(row, col, value)
+        else:
+            self.worksheet.update_cell(row, col, value)
+
+        with self.lock:
+            self._touch(row)
+            values = self.rows.setdefault(row, [])
+            while len(values) < col:
+                values.append("")
+            values[col - 1] = value
+
+            if col == 1:
+                phone = clean_number(value)
+                if phone:
+                    self.by_phone.setdefault(phone, row)
+
+    def flushed(self, rows):
+        with self.lock:
+            for row in rows:
+                count = self.unflushed.pop(row, 0) - 1
+                if count > 0:
+                    self.unflushed[row] = count
+
+    def append_row(self, values):
+        response = self.worksheet.append_row(values)
+
+        row = None
+        try:
+            updated_range = response["updates"]["updatedRange"]
+            row = int(re.search(r"![A-Z]+(\d+)", updated_range).group(1))
+        except Exception:
+            pass
+
+        with self.lock:
+            if row is None:
+                # Could not tell where the row landed, re-read on next lookup
+                self.invalidate()
+                return None
+
+            self._touch(row)
+            self.rows[row] = list(values)
+            self.last_row = max(self.last_row, row)
+
+            phone = clean_number(values[0]) if values else ""
+            if phone:
+                self.by_phone.setdefault(phone, row)
+
+        return row
+
+    def append_rows(self, rows):
+        response = self.worksheet.append_rows(rows)
+
+        first = None
+        try:
+            updated_range = response["updates"]["updatedRange"]
+            first = int(re.search(r"![A-Z]+(\d+)", updated_range).group(1))
+        except Exception:
+            pass
+
+        with self.lock:
+            if first is None:
+                self.invalidate()
+                return None
+
+            for offset, values in enumerate(rows):
+                row = first + offset
+                self._touch(row)
+                self.rows[row] = list(values)
+                self.last_row = max(self.last_row, row)
+
+                phone = clean_number(values[0]) if values else ""
+                if phone:
+                    self.by_phone.setdefault(phone, row)
+
+        return first
+
+
+lead_index = LeadIndex(sheet)
+
+# ============================================================
+#                     WRITE BUFFER
+# ============================================================
+
+_write_buffers = threading.local()
+
+
+class SheetWriteBuffer:
+    # Collects the cell updates made while handling one message so they go
+    # out as a single batch_update instead of one update_cell per column.
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.cells = {}   # (row, col) -> value, last write wins
+        self.rows = set()
+
+    def add(self, row, col, value):
+        self.cells[(row, col)] = value
+
+    def ranges(self):
+        by_row = {}
+        for (row, col), value in self.cells.items():
+            by_row.setdefault(row, {})[col] = value
+
+        data = []
+        for row in sorted(by_row):
+            cols = by_row[row]
+            run = []
+
+            # One range per run of adjacent columns on the same row
+            for col in sorted(cols):
+                if run and col != run[-1] + 1:
+                    data.append(self._range(row, run, cols))
+                    run = []
+                run.append(col)
+
+            if run:
+                data.append(self._range(row, run, cols))
+
+        return data
+
+    def _range(self, row, run, cols):
+        start = rowcol_to_a1(row, run[0])
+        end = rowcol_to_a1(row, run[-1])
+        return {
+            "range": start if start == end else f"{start}:{end}",
+            "values": [[cols[col] for col in run]]
+        }
+
+    def flush(self):
+        if not self.cells:
+            return
+
+        data = self.ranges()
+        self.cells = {}
+        self.worksheet.batch_update(data)
+
+
+@contextmanager
+def sheet_write_batch(strict=False):
+    # Nested batches join the outermost one. With strict=True a failed flush
+    # is raised to the caller instead of only being logged.
+    if getattr(_write_buffers, "current", None) is not None:
+        yield _write_buffers.current
+        return
+
+    buffer = SheetWriteBuffer(sheet)
+    _write_buffers.current = buffer
+
+    try:
+        yield buffer
+    finally:
+        _write_buffers.current = None
+
+        try:
+            buffer.flush()
+        except Exception as e:
+            log_event("sheet_write_failed", logging.ERROR, error=str(e))
+            # The index already holds the unsaved values, re-read the sheet
+            lead_index.invalidate()
+
+            if strict:
+                raise
+        finally:
+            lead_index.flushed(buffer.rows)
 
 # ============================================================
 #                     SESSION MEMORY
 # ============================================================
 
+# Conversation state (MENU / ASK_NAME / ASK_VISIT_TIME) per phone.
+# "sqlite" survives restarts and is shared by all workers, "memory" is
+# per process. Abandoned flows fall back to MENU after SESSION_TTL_HOURS.
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite")
+SESSION_TTL = float(os.environ.get("SESSION_TTL_HOURS", 12)) * 3600
+
+
+class MemorySessionStore:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.states = {}   # phone -> (state, expires_at)
+
+    def get(self, phone):
+        with self.lock:
+            entry = self.states.get(phone)
+
+            if entry is None:
+                return None
+
+            if entry[1] < time.time():
+                del self.states[phone]
+                return None
+
+            return entry[0]
+
+    def set(self, phone, state):
+        with self.lock:
+            self.states[phone] = (state, time.time() + self.ttl)
+
+    def clear(self, phone):
+        with self.lock:
+            self.states.pop(phone, None)
+
+    def in_states(self, states):
+        now = time.time()
+        with self.lock:
+            return {p for p, (state, expires_at) in self.states.items() if state in states and expires_at >= now}
+
+    def purge(self):
+        now = time.time()
+        with self.lock:
+            expired = [p for p, (_, expires_at) in self.states.items() if expires_at < now]
+            for phone in expired:
+                del self.states[phone]
+
+
+class SqliteSessionStore:
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(phone TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)")
+
+    def get(self, phone):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT state FROM sessions WHERE phone = ? AND expires_at >= ?",
+                (phone, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, phone, state):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions (phone, state, expires_at) VALUES (?, ?, ?)",
+                (phone, state, time.time() + self.ttl)
+            )
+
+    def clear(self, phone):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM sessions WHERE phone = ?", (phone,))
+
+    def in_states(self, states):
+        # Phones whose live session is in one of states
+        placeholders = ", ".join("?" for _ in states)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT phone FROM sessions WHERE state IN ({placeholders}) AND expires_at >= ?",
+                list(states) + [time.time()]
+            ).fetchall()
+        return {phone for phone, in rows}
+
+    def purge(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+
+
+if SESSION_STORE == "memory":
+    session_store = MemorySessionStore(SESSION_TTL)
+else:
+    session_store = SqliteSessionStore(DATA_DB_PATH, SESSION_TTL)
+
 
 # ============================================================
 #                     SCHEDULER
 # ============================================================
 
+# Only the worker holding this lock runs reminders and other scheduled
+# jobs; the others keep retrying so one of them takes over if it exits.
+SCHEDULER_LOCK_PATH = os.environ.get("SCHEDULER_LOCK_PATH", DATA_DB_PATH + ".scheduler.lock")
+
+# How often the scheduler worker picks up trials booked on other workers
+REMINDER_SYNC_SECONDS = int(os.environ.get("REMINDER_SYNC_SECONDS", 15))
+
+
+class LeaderLock:
+    # Non-blocking exclusive flock on a file. The OS drops it when the
+    # holding process dies, so no stale lock is left behind.
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    @property
+    def held(self):
+        return self.fd is not None
+
+    def try_acquire(self):
+        if self.fd is not None:
+            return True
+
+        if fcntl is None:
+            self.fd = -1
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        return True
+
+
+scheduler_lock = LeaderLock(SCHEDULER_LOCK_PATH)
+
+# Started by start_background_services(), not at import
 scheduler = BackgroundScheduler(daemon=True)
-scheduler.start()
+atexit.register(metrics.flush)
 
 scheduled_jobs = {}
-last_processed = {}
+
+# ============================================================
+#                     WEBHOOK DEDUPE
+# ============================================================
+
+# Gupshup retries a delivery it did not see acknowledged; the message id
+# is remembered this long, for at most this many messages.
+DEDUPE_TTL = int(os.environ.get("DEDUPE_TTL_SECONDS", 24 * 3600))
+DEDUPE_MAX_ENTRIES = int(os.environ.get("DEDUPE_MAX_ENTRIES", 50000))
+
+
+class MessageDeduper:
+    # Inbound message ids seen by any worker, in the shared SQLite file
+
+    def __init__(self, path, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+        self.inserts = 0
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages "
+                "(id TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS processed_messages_seen ON processed_messages (seen_at)"
+            )
+
+    def is_duplicate(self, message_id):
+        now = time.time()
+
+        with self.lock, self.conn:
+            # Inserts a new id, or revives one whose entry has expired;
+            # touches nothing (rowcount 0) for a live duplicate.
+            cur = self.conn.execute(
+                "INSERT INTO processed_messages (id, seen_at) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET seen_at = excluded.seen_at "
+                "WHERE processed_messages.seen_at < ?",
+                (message_id, now, now - self.ttl)
+            )
+            duplicate = cur.rowcount == 0
+            self.inserts += 1
+
+        if not duplicate and self.inserts % 500 == 0:
+            self.evict()
+
+        return duplicate
+
+    def evict(self):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM processed_messages WHERE seen_at < ?",
+                (time.time() - self.ttl,)
+            )
+            self.conn.execute(
+                "DELETE FROM processed_messages WHERE id IN ("
+                "SELECT id FROM processed_messages ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+
+deduper = MessageDeduper(DATA_DB_PATH, DEDUPE_TTL, DEDUPE_MAX_ENTRIES)
+
 # ============================================================
 #                     HELPERS
 # ============================================================
@@ -145,440 +1279,1938 @@ def now_str():
     return datetime.now().strftime("%d-%m-%Y %H:%M")
 
 
-def clean_number(num):
-    if not num:
-        return ""
-    num = str(num)
-    num = num.replace("whatsapp:", "").replace("+", "").strip()
-    num = re.sub(r"\D", "", num)
-    return num
+# Website chat visitors have no phone number; they are keyed "web:<session>"
+WEB_LEAD_PREFIX = "web:"
+
+
+def is_web_lead(phone):
+    return str(phone).startswith(WEB_LEAD_PREFIX)
+
+
+def clean_number(num):
+    if not num:
+        return ""
+    num = str(num)
+    if num.startswith(WEB_LEAD_PREFIX):
+        return num
+    num = num.replace("whatsapp:", "").replace("+", "").strip()
+    num = re.sub(r"\D", "", num)
+    return num
+
+
+def extract_name(text):
+    text = text.strip()
+    match = re.search(r"(my name is|i am|this is|mera naam|mein)\s+(.+)", text, re.IGNORECASE)
+    if match:
+        return match.group(2).strip().title()
+    return text.title()
+
+
+def get_user_state(phone):
+    return session_store.get(clean_number(phone)) or "MENU"
+
+
+def set_user_state(phone, state_value):
+    phone = clean_number(phone)
+
+    # MENU is the default, so there is nothing to keep
+    if state_value == "MENU":
+        session_store.clear(phone)
+    else:
+        session_store.set(phone, state_value)
+
+
+def lead_scoring(message):
+    return classify_message(message.lower()).lead_type
+
+
+LEAD_TYPE_RANK = {"COLD": 0, "WARM": 1, "HOT": 2}
+
+
+def find_row_by_phone(phone):
+    # None only when the phone is really not in the sheet; a failed lookup
+    # raises, so callers never take an unreachable sheet for a missing lead
+    with metrics.timer("find_row_seconds"):
+        return lead_index.find(clean_number(phone))
+
+
+def save_or_update_lead(phone, name="", interest="", lead_type="COLD", trial_status="", last_message=""):
+    lead = LeadContext.load(phone)
+    lead.update(
+        name=name,
+        interest=interest,
+        lead_type=lead_type,
+        trial_status=trial_status,
+        last_message=last_message
+    )
+    lead.save()
+
+
+# ============================================================
+#                     LEAD CONTEXT
+# ============================================================
+
+# Lead sheet columns (1-based)
+COL_PHONE = 1
+COL_NAME = 2
+COL_INTEREST = 3
+COL_LEAD_TYPE = 4
+COL_TRIAL_STATUS = 5
+COL_LAST_MESSAGE = 6
+COL_TIMESTAMP = 7
+COL_REMINDER_TIME = 8
+COL_REMINDER_SENT = 9
+COL_REVIEW_TIME = 10
+COL_REVIEW_SENT = 11
+COL_STATE = 13
+LEAD_COLUMNS = 13
+
+
+LEAD_FIELDS = [
+    "phone",
+    "name",
+    "interest",
+    "lead_type",
+    "trial_status",
+    "last_message",
+    "timestamp",
+    "reminder_time",
+    "reminder_sent",
+    "review_time",
+    "review_sent",
+    "extra",          # column 12 is not used by the bot
+    "state"           # legacy, conversation state is in the session store
+]
+
+
+class LeadContext:
+    # One lead's row, loaded once per turn. Reads and writes during the turn
+    # go to this copy; save() writes the changed columns to the lead store.
+
+    def __init__(self, phone, values=None):
+        self.phone = phone
+        self.is_new = values is None
+        self.values = list(values or [])
+        self.dirty = set()
+        self.intent = None    # set by handle_message, for logging
+
+        while len(self.values) < LEAD_COLUMNS:
+            self.values.append("")
+
+        if self.is_new:
+            self.values[COL_PHONE - 1] = phone
+
+    @classmethod
+    def load(cls, phone):
+        phone = clean_number(phone)
+        return cls(phone, lead_store.get(phone))
+
+    @property
+    def exists(self):
+        # A lead created earlier in this turn counts, even before save()
+        return not self.is_new or bool(self.dirty)
+
+    def get(self, col):
+        return self.values[col - 1]
+
+    def set(self, col, value):
+        self.values[col - 1] = value
+        self.dirty.add(col)
+
+    @property
+    def name(self):
+        return self.get(COL_NAME)
+
+    @property
+    def trial_status(self):
+        return self.get(COL_TRIAL_STATUS)
+
+    # Conversation state lives in the session store, not in the lead row
+    @property
+    def state(self):
+        return get_user_state(self.phone)
+
+    @state.setter
+    def state(self, value):
+        set_user_state(self.phone, value)
+
+    def update(self, name="", interest="", lead_type="COLD", trial_status="", last_message=""):
+        # Only update fields if value is provided
+        if name:
+            self.set(COL_NAME, name)
+
+        if interest:
+            self.set(COL_INTEREST, interest)
+
+        # One message never lowers the score; rescore_leads() cools leads
+        # down once they go quiet
+        current = LEAD_TYPE_RANK.get(self.get(COL_LEAD_TYPE), -1)
+        if lead_type and LEAD_TYPE_RANK.get(lead_type, 0) >= current:
+            self.set(COL_LEAD_TYPE, lead_type)
+
+        if trial_status:
+            self.set(COL_TRIAL_STATUS, trial_status)
+
+        if last_message:
+            self.set(COL_LAST_MESSAGE, last_message)
+
+        # Always update timestamp
+        self.set(COL_TIMESTAMP, now_str())
+
+    @property
+    def worth_keeping(self):
+        # Website visitors are only saved once they give a name or book a trial
+        return not (self.is_new and is_web_lead(self.phone)) or bool(self.name or self.trial_status)
+
+    def save(self):
+        if not self.dirty or not self.worth_keeping:
+            return
+
+        try:
+            changes = {col: self.get(col) for col in self.dirty}
+
+            if self.is_new:
+                lead_store.insert(self.phone, self.values)
+                log_event("lead_created", phone=self.phone)
+            else:
+                lead_store.update(self.phone, changes)
+                log_event("lead_updated", logging.DEBUG, phone=self.phone, cols=sorted(changes))
+
+            self.is_new = False
+            self.dirty = set()
+
+        except Exception as e:
+            log_event("lead_save_failed", logging.ERROR, phone=self.phone, error=str(e))
+
+
+# ============================================================
+#                     LEAD STORE
+# ============================================================
+
+# "sqlite": leads are read and written locally and copied to the sheet in
+#           the background (the sheet stays the owner's view).
+# "sheet":  leads live only in the Google Sheet.
+LEAD_STORE = os.environ.get("LEAD_STORE", "sqlite")
+
+# How often queued lead changes are copied to the sheet, in seconds
+SHEET_MIRROR_INTERVAL = float(os.environ.get("SHEET_MIRROR_INTERVAL", 2))
+
+# After failed passes the wait doubles, up to this many seconds
+SHEET_MIRROR_MAX_BACKOFF = 60
+
+# A claim to append a lead's row that was never completed (the worker died
+# mid-append) may be taken over by another worker after this many seconds
+SHEET_APPEND_CLAIM_SECONDS = int(os.environ.get("SHEET_APPEND_CLAIM_SECONDS", 300))
+
+
+class SheetRowClaims:
+    # Which worker appends a new lead's sheet row. Every gunicorn worker has
+    # its own lead index, which may not have seen a row another worker just
+    # appended, so a lead's row is only appended by the worker that claims
+    # the phone here first. The others wait for the row to reach their index.
+
+    def __init__(self, path, stale_after):
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+
+        with self.lock, self.conn:
+            # row is 0 while the append is in flight, -1 if it landed on an unknown row
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sheet_rows "
+                "(phone TEXT PRIMARY KEY, row INTEGER NOT NULL, claimed_at REAL NOT NULL)"
+            )
+
+    def claim(self, phones):
+        # Returns the phones this worker should append
+        now = time.time()
+        claimed = []
+
+        with self.lock, self.conn:
+            for phone in phones:
+                cur = self.conn.execute(
+                    "INSERT INTO sheet_rows (phone, row, claimed_at) VALUES (?, 0, ?) "
+                    "ON CONFLICT (phone) DO UPDATE SET claimed_at = excluded.claimed_at "
+                    "WHERE sheet_rows.row = 0 AND sheet_rows.claimed_at < ?",
+                    (phone, now, now - self.stale_after)
+                )
+                if cur.rowcount:
+                    claimed.append(phone)
+
+        return claimed
+
+    def appended(self, rows):
+        # rows: {phone: sheet row, or None if not known}
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE sheet_rows SET row = ? WHERE phone = ?",
+                [(row or -1, phone) for phone, row in rows.items()]
+            )
+
+    def release(self, phones):
+        # The append failed, let whichever worker tries next claim it
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM sheet_rows WHERE phone = ? AND row = 0", [(phone,) for phone in phones]
+            )
+
+
+class SheetLeadStore:
+    # Leads live in the Google Sheet, read through the lead index
+
+    def get(self, phone):
+        row = find_row_by_phone(phone)
+        return lead_index.row_values(row) if row else None
+
+    def insert(self, phone, values):
+        if not sheet_rows.claim([phone]):
+            # Another worker is adding (or added) this lead's row
+            lead_index.read_new_rows()
+            self.update(phone, {
+                col: v for col, v in enumerate(values, start=1) if v and col != COL_PHONE
+            })
+            return
+
+        try:
+            row = lead_index.append_row(list(values))
+        except Exception:
+            sheet_rows.release([phone])
+            raise
+
+        sheet_rows.appended({phone: row})
+
+    def update(self, phone, changes):
+        row = find_row_by_phone(phone)
+
+        if not row:
+            raise LookupError(f"No lead row for {phone}")
+
+        for col in sorted(changes):
+            lead_index.update_cell(row, col, changes[col])
+
+    def update_many(self, changes_by_phone):
+        # One batch_update for every lead; raises if it did not go through
+        with sheet_write_batch(strict=True):
+            for phone, changes in changes_by_phone.items():
+                if find_row_by_phone(phone):
+                    self.update(phone, changes)
+                else:
+                    log_event("lead_row_missing", logging.WARNING, phone=phone)
+
+    def update_lead_types(self, changes):
+        # changes: {phone: (values scored, new type)}; skipped where the row
+        # moved on. The sheet has no compare-and-set, so the check and the
+        # write happen under the leads' sender lock shard, one shard at a
+        # time. Lookups and the wait for a write token come before locking,
+        # so a shard's messages only ever wait for one batch_update.
+        by_shard = {}
+
+        for phone in changes:
+            if find_row_by_phone(phone):
+                by_shard.setdefault(sender_locks.shard_of(phone), []).append(phone)
+
+        applied = 0
+
+        for shard, phones in sorted(by_shard.items()):
+            sheets_write_bucket.acquire(BACKGROUND)
+
+            try:
+                with sender_locks.hold_shard(shard), sheets_priority(PREPAID):
+                    with sheet_write_batch(strict=True):
+                        written = 0
+
+                        for phone in phones:
+                            seen, new = changes[phone]
+                            row, values = lead_index.cached(phone)
+
+                            if row and all(lead_cells(values)[col - 1] == seen[col - 1] for col in RESCORE_GUARD_COLUMNS):
+                                lead_index.update_cell(row, COL_LEAD_TYPE, new)
+                                written += 1
+
+                applied += written
+            except Exception as e:
+                # Not retried under the lock; the next run rescores them
+                log_event("rescore_write_failed", logging.WARNING, leads=len(phones), error=str(e))
+
+        return applied
+
+    def iter_leads(self):
+        # sync_sheet() keeps the index current, no need to download it again
+        rows = lead_index.snapshot()
+
+        for values in rows[1:]:
+            if values and clean_number(values[0]):
+                yield values
+
+
+class SqliteLeadStore:
+    # Leads live in a local SQLite table keyed on phone. Every change is
+    # queued on the sheet mirror so the Google Sheet follows along.
+
+    def __init__(self, path, mirror=None):
+        self.mirror = mirror
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+
+        columns = ", ".join(f"{f} TEXT NOT NULL DEFAULT ''" for f in LEAD_FIELDS[1:])
+        with self.lock, self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS leads (phone TEXT PRIMARY KEY, {columns})")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def is_imported(self):
+        # Set once the sheet has been imported, by whichever worker did it.
+        # Leads created by messages before that do not count.
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM store_meta WHERE key = 'sheet_imported'"
+            ).fetchone() is not None
+
+    def import_rows(self, rows):
+        # Seed from the sheet rows; the first row for a phone wins. A lead
+        # already in the store (a message during warm-up, another worker's
+        # import) keeps its own values, takes the sheet's for the columns it
+        # has blank and the higher of the two lead types.
+        by_phone = {}
+
+        for values in rows:
+            phone = clean_number(values[0]) if values else ""
+            if not phone or phone in by_phone:
+                continue
+
+            values = list(values[:LEAD_COLUMNS])
+            values += [""] * (LEAD_COLUMNS - len(values))
+            values[0] = phone
+            by_phone[phone] = values
+
+        placeholders = ", ".join("?" for _ in LEAD_FIELDS)
+        assignments = ", ".join(f"{f} = ?" for f in LEAD_FIELDS[1:])
+        lead_type = COL_LEAD_TYPE - 1
+
+        with self.lock:
+            # Nobody can add a lead between reading the store and writing
+            self.conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                existing = {row[0]: list(row) for row in self.conn.execute("SELECT * FROM leads")}
+                new, merged = [], {}
+
+                for phone, values in by_phone.items():
+                    current = existing.get(phone)
+                    if current is None:
+                        new.append(values)
+                        continue
+
+                    row = [mine or theirs for mine, theirs in zip(current, values)]
+                    row[lead_type] = max(
+                        current[lead_type], values[lead_type], key=lambda v: LEAD_TYPE_RANK.get(v, -1)
+                    )
+                    if row != current:
+                        self.conn.execute(f"UPDATE leads SET {assignments} WHERE phone = ?", row[1:] + [phone])
+
+                    # What the sheet row is missing of the merged lead
+                    merged[phone] = {
+                        col: row[col - 1] for col in range(2, LEAD_COLUMNS + 1) if row[col - 1] != values[col - 1]
+                    }
+
+                self.conn.executemany(f"INSERT INTO leads VALUES ({placeholders})", new)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('sheet_imported', ?)", (now_str(),)
+                )
+                self.conn.commit()
+
+            except Exception:
+                self.conn.rollback()
+                raise
+
+            if self.mirror:
+                for phone, changes in merged.items():
+                    if changes:
+                        self.mirror.push(phone, changes)
+
+        return len(by_phone)
+
+    def get(self, phone):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM leads WHERE phone = ?", (phone,)).fetchone()
+        return list(row) if row else None
+
+    def insert(self, phone, values):
+        placeholders = ", ".join("?" for _ in LEAD_FIELDS)
+
+        with self.lock, self.conn:
+            cur = self.conn.execute(f"INSERT OR IGNORE INTO leads VALUES ({placeholders})", list(values))
+            inserted = cur.rowcount == 1
+
+        if not inserted:
+            # Another worker created it first, keep our non-empty columns
+            self.update(phone, {
+                col: v for col, v in enumerate(values, start=1) if v and col != COL_PHONE
+            })
+            return
+
+        if self.mirror:
+            self.mirror.push(phone, {})
+
+    def update(self, phone, changes):
+        if not changes:
+            return
+
+        cols = sorted(changes)
+        assignments = ", ".join(f"{LEAD_FIELDS[col - 1]} = ?" for col in cols)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"UPDATE leads SET {assignments} WHERE phone = ?",
+                [changes[col] for col in cols] + [phone]
+            )
+
+        if self.mirror:
+            self.mirror.push(phone, changes)
+
+    def update_many(self, changes_by_phone):
+        # All leads in one transaction, then one mirror push per lead
+        with self.lock, self.conn:
+            for phone, changes in changes_by_phone.items():
+                cols = sorted(changes)
+                assignments = ", ".join(f"{LEAD_FIELDS[col - 1]} = ?" for col in cols)
+                self.conn.execute(
+                    f"UPDATE leads SET {assignments} WHERE phone = ?",
+                    [changes[col] for col in cols] + [phone]
+                )
+
+        if self.mirror:
+            for phone, changes in changes_by_phone.items():
+                self.mirror.push(phone, changes)
+
+    def update_lead_types(self, changes):
+        # changes: {phone: (values scored, new type)} in one transaction. A
+        # lead that got a message (or an edit) since it was read is left
+        # alone, see RESCORE_GUARD_COLUMNS.
+        guard = " AND ".join(f"{LEAD_FIELDS[col - 1]} = ?" for col in RESCORE_GUARD_COLUMNS)
+        applied = 0
+
+        with self.lock, self.conn:
+            for phone, (seen, new) in changes.items():
+                cur = self.conn.execute(
+                    f"UPDATE leads SET lead_type = ? WHERE phone = ? AND {guard}",
+                    [new, phone] + [seen[col - 1] for col in RESCORE_GUARD_COLUMNS]
+                )
+
+                # Queued before the lock is released, so a newer message's
+                # change to the same lead is always mirrored after this one
+                if cur.rowcount:
+                    applied += 1
+                    if self.mirror:
+                        self.mirror.push(phone, {COL_LEAD_TYPE: new})
+
+        return applied
+
+    def apply_sheet_edits(self, changes):
+        # changes: [(row, old values, new values)] from lead_index.sync().
+        # A column is only taken from the sheet while the store still holds
+        # the old sheet value, so edits made here win over a stale sheet.
+        placeholders = ", ".join("?" for _ in LEAD_FIELDS)
+        applied = 0
+
+        with self.lock, self.conn:
+            for row, old, new in changes:
+                old = lead_cells(old)
+                new = lead_cells(new)
+                phone = clean_number(new[0])
+
+                if not phone:
+                    continue
+
+                if phone != clean_number(old[0]):
+                    # A lead typed into the sheet (or moved there)
+                    cur = self.conn.execute(
+                        f"INSERT OR IGNORE INTO leads VALUES ({placeholders})", [phone] + new[1:]
+                    )
+                    applied += cur.rowcount
+                    continue
+
+                for col in range(2, LEAD_COLUMNS + 1):
+                    if old[col - 1] != new[col - 1]:
+                        field = LEAD_FIELDS[col - 1]
+                        cur = self.conn.execute(
+                            f"UPDATE leads SET {field} = ? WHERE phone = ? AND {field} = ?",
+                            (new[col - 1], phone, old[col - 1])
+                        )
+                        applied += cur.rowcount
+
+        return applied
+
+    def iter_leads(self, page_size=500):
+        # Pages by rowid so big scans never hold the lock for long
+        last = 0
+
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, * FROM leads WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, page_size)
+                ).fetchall()
+
+            if not rows:
+                return
+
+            last = rows[-1][0]
+            for row in rows:
+                yield list(row[1:])
+
+
+# ============================================================
+#                     SHEET MIRROR
+# ============================================================
+
+class SheetMirror:
+    # Copies lead changes from the local store to the Google Sheet on a
+    # background thread. Changes for the same phone are merged, and each
+    # pass costs one batch_update plus one append_rows for new leads. A lead
+    # whose row another worker is appending keeps its changes queued until
+    # that row shows up, see SheetRowClaims.
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()   # one pass at a time
+        self.pending = {}   # phone -> {col: value}
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.failures = 0   # passes failed in a row, for backing off
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="sheet-mirror", daemon=True)
+            self.thread.start()
+
+    def push(self, phone, changes):
+        with self.lock:
+            self.pending.setdefault(phone, {}).update(changes)
+
+    def _run(self):
+        while True:
+            # While the sheet is unreachable, try less and less often
+            self.wakeup.wait(min(self.interval * 2 ** self.failures, SHEET_MIRROR_MAX_BACKOFF))
+            self.wakeup.clear()
+            self.flush()
+
+    def _requeue(self, pending):
+        # Put failed changes back without overwriting newer ones
+        with self.lock:
+            for phone, changes in pending.items():
+                merged = dict(changes)
+                merged.update(self.pending.get(phone, {}))
+                self.pending[phone] = merged
+
+    def flush(self):
+        # Waits for a pass already running, so callers know their changes
+        # have been written (or re-queued) when this returns.
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        if not pending:
+            return
+
+        appending = []
+
+        try:
+            missing = []
+
+            with sheet_write_batch(strict=True):
+                for phone, changes in pending.items():
+                    # A failed lookup ends the pass; only leads surely not
+                    # in the sheet may be appended
+                    row = lead_index.find(phone)
+
+                    if row:
+                        for col in sorted(changes):
+                            lead_index.update_cell(row, col, changes[col])
+                    else:
+                        missing.append(phone)
+
+            appending = sheet_rows.claim(missing) if missing else []
+            waiting = set(missing) - set(appending)
+            new_rows = []
+
+            for phone in appending:
+                values = lead_store.get(phone)
+                if values:
+                    new_rows.append(values)
+                else:
+                    sheet_rows.release([phone])
+
+            if new_rows:
+                first = lead_index.append_rows(new_rows)
+                appending = []
+                sheet_rows.appended({
+                    clean_number(values[0]): first + offset if first else None
+                    for offset, values in enumerate(new_rows)
+                })
+
+            if waiting:
+                self._requeue({phone: pending[phone] for phone in waiting})
+
+            log_event("sheet_mirrored", logging.DEBUG, leads=len(pending) - len(waiting), waiting=len(waiting))
+            self.failures = 0
+
+        except Exception as e:
+            log_event("sheet_mirror_failed", logging.ERROR, leads=len(pending), error=str(e))
+            if appending:
+                sheet_rows.release(appending)
+            self._requeue(pending)
+            self.failures = min(self.failures + 1, 10)
+
+
+sheet_rows = SheetRowClaims(DATA_DB_PATH, SHEET_APPEND_CLAIM_SECONDS)
+
+if LEAD_STORE == "sheet":
+    sheet_mirror = None
+    lead_store = SheetLeadStore()
+else:
+    sheet_mirror = SheetMirror(SHEET_MIRROR_INTERVAL)
+    lead_store = SqliteLeadStore(DATA_DB_PATH, sheet_mirror)
+    atexit.register(sheet_mirror.flush)
+
+
+def sync_sheet():
+    # Picks up the owner's edits in the sheet, see SHEET_SYNC_SECONDS
+    try:
+        with sheets_priority(BACKGROUND):
+            changes = lead_index.sync()
+
+        if changes and sheet_mirror:
+            count = lead_store.apply_sheet_edits(changes)
+            if count:
+                log_event("sheet_edits_applied", edits=count)
+
+    except Exception as e:
+        log_event("sheet_sync_failed", logging.ERROR, error=str(e))
+
+
+# ============================================================
+#                     GUPSHUP CLIENT
+# ============================================================
+
+class GupshupClient:
+    # One keep-alive session shared by every send function, so messages
+    # reuse pooled TLS connections instead of opening one per request.
+
+    def __init__(self, api_key, source, app_name):
+        self.source = clean_number(source)
+        self.app_name = app_name
+
+        # Only retry when the request surely did not go through: connection
+        # failures, and 429 / 503 which Gupshup answers before taking the
+        # message. A read timeout, 502 or 504 may come after the message was
+        # accepted, so those are never retried and a message is not sent twice.
+        retry = Retry(
+            total=GUPSHUP_MAX_RETRIES,
+            connect=GUPSHUP_MAX_RETRIES,
+            read=0,
+            status=GUPSHUP_MAX_RETRIES,
+            status_forcelist=(429, 503),
+            allowed_methods=frozenset(["POST"]),
+            backoff_factor=0.5,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=GUPSHUP_POOL_SIZE,
+            max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "apikey": api_key,
+            "Content-Type": "application/x-www-form-urlencoded"
+        })
+
+    def post(self, url, payload):
+        endpoint = "template" if url == GUPSHUP_TEMPLATE_URL else "msg"
+        started = time.perf_counter()
+        status = "error"
+
+        try:
+            r = self.session.post(url, data=payload, timeout=GUPSHUP_TIMEOUT)
+            status = str(r.status_code)
+            return r
+        finally:
+            metrics.observe("gupshup_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc("gupshup_requests_total", endpoint=endpoint, status=status)
+
+    def send_message(self, to, msg):
+        payload = {
+            "channel": "whatsapp",
+            "source": self.source,
+            "destination": clean_number(to),
+            "message": json.dumps(msg),
+            "src.name": self.app_name
+        }
+        return self.post(GUPSHUP_SEND_URL, payload)
+
+    def send_template(self, to, template_id, params):
+        payload = {
+            "source": self.source,
+            "destination": clean_number(to),
+            "template": json.dumps({
+                "id": template_id,
+                "params": params
+            })
+        }
+        return self.post(GUPSHUP_TEMPLATE_URL, payload)
+
+
+gupshup = GupshupClient(GUPSHUP_API_KEY, GUPSHUP_SOURCE_NUMBER, GUPSHUP_APP_NAME)
+
+
+# ============================================================
+#                   OUTBOUND DISPATCH
+# ============================================================
+
+class KeyedDispatcher:
+    # Runs jobs on a pool of worker threads. Jobs with the same key always
+    # land on the same worker, so they run one after another in the order
+    # they were submitted while different keys run in parallel. The threads
+    # start with start_background_services() or the first job.
+
+    def __init__(self, workers, name):
+        self.name = name
+        self.queues = [queue.Queue() for _ in range(max(workers, 1))]
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+
+            for i, q in enumerate(self.queues):
+                worker = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+                worker.start()
+
+    def submit(self, key, fn, *args, **kwargs):
+        if not self.started:
+            self.start()
+
+        q = self.queues[hash(key) % len(self.queues)]
+        q.put((fn, args, kwargs))
+
+    def _run(self, q):
+        while True:
+            fn, args, kwargs = q.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                log_event("dispatch_failed", logging.ERROR, job=getattr(fn, "__name__", ""), error=str(e))
+            finally:
+                q.task_done()
+
+    def pending(self):
+        return sum(q.unfinished_tasks for q in self.queues)
+
+    def drain(self, timeout=None):
+        # Wait until every submitted job has finished (or timeout expires)
+        deadline = time.time() + timeout if timeout is not None else None
+
+        while self.pending():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+
+        return True
+
+
+outbound = KeyedDispatcher(OUTBOUND_WORKERS, "outbound")
+
+# Give queued replies a chance to go out when the worker shuts down
+atexit.register(outbound.drain, 10)
+
+
+# ============================================================
+#                   INBOUND QUEUES
+# ============================================================
+
+# The webhook only adds a message to the inbound_messages table, shared by
+# all gunicorn workers, and returns. Its id there records the arrival order.
+# The worker that then takes the sender's lock shard (a thread lock plus a
+# byte-range file lock, so other processes wait for it too) handles all of
+# that sender's queued messages, oldest first, and sends each reply before
+# letting go. So one sender's messages are handled and answered in arrival
+# order whichever worker received them. Different senders run in parallel.
+INBOUND_WORKERS = int(os.environ.get("INBOUND_WORKERS", 16))
+INBOUND_LOCK_SHARDS = int(os.environ.get("INBOUND_LOCK_SHARDS", 64))
+INBOUND_LOCK_PATH = os.environ.get("INBOUND_LOCK_PATH", DATA_DB_PATH + ".senders.lock")
+
+
+class SenderLocks:
+    # A fixed set of lock shards. crc32 keeps a sender on the same shard in
+    # every process (hash() is salted per process).
+
+    def __init__(self, path, shards):
+        self.locks = [threading.Lock() for _ in range(max(shards, 1))]
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644) if fcntl else None
+
+    def shard_of(self, sender):
+        return zlib.crc32(sender.encode()) % len(self.locks)
+
+    @contextmanager
+    def hold(self, sender):
+        with self.hold_shard(self.shard_of(sender)):
+            yield
+
+    @contextmanager
+    def hold_shard(self, shard):
+        with self.locks[shard]:
+            if self.fd is None:
+                yield
+                return
+
+            # POSIX record locks belong to the process, so the thread lock
+            # above is what keeps this process's own threads apart
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, shard)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, shard)
+
+
+class InboundQueue:
+    # Messages not yet picked up, oldest first per sender. Ids come from one
+    # SQLite sequence, so they follow arrival order across workers.
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS inbound_messages "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT NOT NULL, "
+                "message TEXT NOT NULL, button TEXT, received REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS inbound_messages_sender ON inbound_messages (sender, id)"
+            )
+
+    def add(self, sender, message, button):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO inbound_messages (sender, message, button, received) VALUES (?, ?, ?, ?)",
+                (sender, message or "", button, time.time())
+            )
+
+    def take(self, sender):
+        # Removes and returns the sender's oldest message, or None
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT id, message, button FROM inbound_messages WHERE sender = ? ORDER BY id LIMIT 1",
+                (sender,)
+            ).fetchone()
+
+            if row:
+                self.conn.execute("DELETE FROM inbound_messages WHERE id = ?", (row[0],))
+
+        return row[1:] if row else None
+
+    def senders(self):
+        # Senders with messages waiting, e.g. left by a worker that exited
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT sender FROM inbound_messages").fetchall()
+        return [sender for sender, in rows]
+
+
+sender_locks = SenderLocks(INBOUND_LOCK_PATH, INBOUND_LOCK_SHARDS)
+inbound_queue = InboundQueue(DATA_DB_PATH)
+inbound = KeyedDispatcher(INBOUND_WORKERS, "inbound")
+
+# Registered after outbound, so it runs first and the owner alerts it
+# queues still get sent
+atexit.register(inbound.drain, 10)
+
+
+# ============================================================
+#                 GUPSHUP SEND FUNCTIONS
+# ============================================================
+
+def log_send(kind, to, r, **fields):
+    # Accepted sends only at DEBUG; the body is logged only when refused
+    if r.status_code < 300:
+        log_event("gupshup_sent", logging.DEBUG, kind=kind, phone=clean_number(to), status=r.status_code, **fields)
+    else:
+        log_event(
+            "gupshup_refused", logging.WARNING,
+            kind=kind, phone=clean_number(to), status=r.status_code, response=r.text[:300], **fields
+        )
+
+
+def gupshup_send_text(to, text):
+    msg = {
+        "type": "text",
+        "text": text
+    }
+
+    r = gupshup.send_message(to, msg)
+    log_send("text", to, r)
+    return r.text
+
+
+def gupshup_send_image(to, image_url, caption=""):
+    msg = {
+        "type": "image",
+        "originalUrl": image_url,
+        "previewUrl": image_url,
+        "caption": caption
+    }
+
+    r = gupshup.send_message(to, msg)
+    log_send("image", to, r)
+    return r.text
+
+def gupshup_send_trial_buttons(to, name):
+    msg = {
+        "type": "quick_reply",
+        "content": {
+            "type": "text",
+            "text": f"Nice {name} 😊\nAap kab visit karna chahoge?"
+        },
+        "options": [
+            {"title": "📅 Today", "postbackText": "visit_today"},
+            {"title": "📅 Tomorrow", "postbackText": "visit_tomorrow"},
+            {"title": "📅 Some Other Day", "postbackText": "visit_other"}
+        ]
+    }
+
+    r = gupshup.send_message(to, msg)
+    log_send("trial_buttons", to, r)
+    return r.text
+
+
+
+def gupshup_send_buttons(to):
+    msg = {
+        "type": "quick_reply",
+        "content": {
+            "type": "text",
+            "text": WELCOME_TEXT
+        },
+        "options": [
+            {"title": "💰 Fees", "postbackText": "FEES"},
+            {"title": "🎁 Free Trial", "postbackText": "TRIAL"},
+            {"title": "⏰ Timings", "postbackText": "TIMINGS"}
+        ]
+    }
+
+    r = gupshup.send_message(to, msg)
+    log_send("menu", to, r)
+    return r.text
+
+
+def gupshup_send_buttons_2(to):
+    msg = {
+        "type": "quick_reply",
+        "content": {
+            "type": "text",
+            "text": "More options 👇"
+        },
+        "options": [
+            {"title": "📍 Location", "postbackText": "LOCATION"},
+            {"title": "🔥 Transformations", "postbackText": "TRANSFORM"},
+            {"title": "🏋️ Gym Photos", "postbackText": "GYM_PHOTOS"}
+        ]
+    }
+
+    r = gupshup.send_message(to, msg)
+    log_send("menu_2", to, r)
+    return r.text
+
+
+def gupshup_send_template(to, template_id, params=None):
+    if params is None:
+        params = []
+
+    try:
+        r = gupshup.send_template(to, template_id, params)
+        log_send("template", to, r, template=template_id)
+        return r.text
+    except Exception as e:
+        log_event("gupshup_send_failed", logging.ERROR, kind="template", phone=clean_number(to), error=str(e))
+        return None
+
+media_pool = ThreadPoolExecutor(max_workers=MEDIA_POOL_SIZE, thread_name_prefix="media")
+
+
+def gupshup_accepted(response_text):
+    try:
+        return json.loads(response_text).get("status") == "submitted"
+    except Exception:
+        return False
+
+
+def send_media_album(to, intro_text, image_urls):
+    # The intro goes first and is acked before any image starts.
+    gupshup_send_text(to, intro_text)
+
+    slots = threading.BoundedSemaphore(max(MEDIA_CONCURRENCY, 1))
+    stagger = MEDIA_STAGGER_MS / 1000.0
+
+    def send_one(url):
+        try:
+            text = gupshup_send_image(to, url)
+            return {"url": url, "ok": gupshup_accepted(text), "response": text}
+        except Exception as e:
+            return {"url": url, "ok": False, "response": str(e)}
+        finally:
+            slots.release()
+
+    futures = []
+    last_start = 0
+
+    for url in image_urls:
+        slots.acquire()
+
+        # Start times stay in album order, spaced at least `stagger` apart,
+        # so Gupshup receives (and delivers) the images in sequence.
+        wait = last_start + stagger - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        last_start = time.time()
+
+        futures.append(media_pool.submit(send_one, url))
+
+    results = [f.result() for f in futures]
+
+    failed = [r["url"] for r in results if not r["ok"]]
+    log_event(
+        "album_sent", logging.WARNING if failed else logging.INFO,
+        phone=clean_number(to), sent=len(results) - len(failed), failed=failed
+    )
+
+    return results
+
+
+def notify_owner(text):
+    outbound.submit(OWNER_NUMBER, gupshup_send_text, OWNER_NUMBER, text)
+
+
+def gupshup_send_review_template(to, name):
+    r = gupshup.send_template(
+        to,
+        "db504bec-4dd8-4f04-978c-4ddaea2ca0c6",   # replace with EXACT template id
+        [name, REVIEW_LINK]     # {{1}} name, {{2}} link
+    )
+
+    log_send("review_template", to, r)
+    return r.text
+
+
+
+
+
+
+
+
+
+
+# ============================================================
+#                  OWNER NOTIFICATIONS
+# ============================================================
+
+# "immediate": one WhatsApp to the owner per inbound message.
+# "digest":    routine lead activity is collected and sent as one summary
+#              every OWNER_DIGEST_MINUTES or OWNER_DIGEST_MAX_EVENTS events.
+# Trial bookings and confirmations are always sent right away.
+OWNER_NOTIFY_MODE = os.environ.get("OWNER_NOTIFY_MODE", "digest")
+OWNER_DIGEST_MINUTES = int(os.environ.get("OWNER_DIGEST_MINUTES", 15))
+OWNER_DIGEST_MAX_EVENTS = int(os.environ.get("OWNER_DIGEST_MAX_EVENTS", 20))
+
+# Leads listed in one digest, the rest are only counted
+OWNER_DIGEST_MAX_LEADS = 25
+
+
+class OwnerDigest:
+    # Pending activity per phone in the shared SQLite file, so every worker
+    # adds to the same digest and it is sent once.
+
+    def __init__(self, path, max_events):
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS owner_digest "
+                "(phone TEXT PRIMARY KEY, message TEXT NOT NULL, lead_type TEXT NOT NULL, "
+                "events INTEGER NOT NULL, last_at TEXT NOT NULL, last_ts REAL NOT NULL)"
+            )
+
+    def add(self, phone, message, lead_type):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO owner_digest (phone, message, lead_type, events, last_at, last_ts) "
+                "VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (phone) DO UPDATE SET message = excluded.message, "
+                "lead_type = excluded.lead_type, events = events + 1, "
+                "last_at = excluded.last_at, last_ts = excluded.last_ts",
+                (phone, message or "", lead_type, now_str(), time.time())
+            )
+            total = self.conn.execute("SELECT SUM(events) FROM owner_digest").fetchone()[0]
+
+        if total >= self.max_events:
+            self.flush()
+
+    def take(self):
+        # Read and clear in one transaction so a digest is never sent twice
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT phone, message, lead_type, events, last_at FROM owner_digest "
+                "ORDER BY last_ts DESC"
+            ).fetchall()
+            self.conn.execute("DELETE FROM owner_digest")
+        return rows
+
+    def flush(self):
+        rows = self.take()
+        if not rows:
+            return
+
+        total = sum(r[3] for r in rows)
+        lines = [f"🔔 Lead Activity Digest\n\n💬 {total} message(s) from {len(rows)} lead(s)\n"]
+
+        for phone, message, lead_type, events, last_at in rows[:OWNER_DIGEST_MAX_LEADS]:
+            if len(message) > 80:
+                message = message[:77] + "..."
+            lines.append(f"📱 {phone} ({events}) 🔥 {lead_type}\n💬 {message}\n⏰ {last_at}\n")
+
+        if len(rows) > OWNER_DIGEST_MAX_LEADS:
+            lines.append(f"…and {len(rows) - OWNER_DIGEST_MAX_LEADS} more lead(s)")
+
+        notify_owner("\n".join(lines))
+
+
+owner_digest = OwnerDigest(DATA_DB_PATH, OWNER_DIGEST_MAX_EVENTS)
+
+
+def notify_owner_activity(phone, message, lead_type):
+    if OWNER_NOTIFY_MODE == "digest":
+        owner_digest.add(phone, message, lead_type)
+        return
+
+    owner_msg = f"""🔔 New Lead Activity
+
+📱 Phone: {phone}
+💬 Message: {message}
+🔥 Lead Type: {lead_type}
+⏰ Time: {now_str()}
+"""
+    notify_owner(owner_msg)
+
+
+# ============================================================
+#                     FOLLOWUP / REMINDER
+# ============================================================
+
+def followup_message(phone):
+    phone = clean_number(phone)
+
+    text = f"""👋 Hi! Quick follow-up from *{GYM_NAME}* 💪
+
+Aap membership / free trial ke liye interested the 😊
+
+Agar aap chahein toh main free trial slot book kar sakta hoon.
+
+Reply *TRIAL* to book."""
+    gupshup_send_text(phone, text)
+
+
+def reminder_message(phone, name=""):
+    phone = clean_number(phone)
+
+    # Send approved template
+    return gupshup_send_template(
+        phone,
+        "09d6c1db-a107-4621-8543-4a7a608c9919",
+        [name]   # {{1}} variable
+    )
+
+REMINDER_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+# Due reminders are sent in parallel by this many threads
+REMINDER_SEND_WORKERS = int(os.environ.get("REMINDER_SEND_WORKERS", 4))
+
+# A send Gupshup did not accept is tried again later, a few times at most
+REMINDER_RETRY_MINUTES = int(os.environ.get("REMINDER_RETRY_MINUTES", 5))
+REMINDER_MAX_ATTEMPTS = int(os.environ.get("REMINDER_MAX_ATTEMPTS", 3))
+
+# kind -> (due time column, sent flag column)
+REMINDER_KINDS = {
+    "reminder": (COL_REMINDER_TIME, COL_REMINDER_SENT),
+    "review": (COL_REVIEW_TIME, COL_REVIEW_SENT)
+}
+
+
+class ReminderScheduler:
+    # Pending reminder / review jobs in a min-heap ordered by due time. One
+    # thread sleeps until the earliest job is due, so jobs fire on time and
+    # the cost no longer depends on how many leads the store holds.
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []    # (due_ts, phone, kind)
+        self.jobs = {}    # (phone, kind) -> due_ts of the live entry
+        self.attempts = {}  # (phone, kind) -> failed sends so far
+        self.thread = None
+
+    def schedule(self, phone, kind, due):
+        due_ts = due.timestamp()
+
+        with self.cond:
+            # A re-booked trial replaces the old entry, which is then skipped
+            self.jobs[(phone, kind)] = due_ts
+            heapq.heappush(self.heap, (due_ts, phone, kind))
+            self.cond.notify()
+
+    def cancel(self, phone, kind):
+        with self.cond:
+            self.jobs.pop((phone, kind), None)
+
+    def retry(self, phone, kind):
+        with self.cond:
+            attempts = self.attempts.get((phone, kind), 0) + 1
 
+            if attempts >= REMINDER_MAX_ATTEMPTS:
+                self.attempts.pop((phone, kind), None)
+                return False
 
-def extract_name(text):
-    text = text.strip()
-    match = re.search(r"(my name is|i am|this is|mera naam|mein)\s+(.+)", text, re.IGNORECASE)
-    if match:
-        return match.group(2).strip().title()
-    return text.title()
+            self.attempts[(phone, kind)] = attempts
 
+        self.schedule(phone, kind, datetime.now() + timedelta(minutes=REMINDER_RETRY_MINUTES))
+        return True
 
-def get_user_state(phone):
-    row = find_row_by_phone(phone)
-    if row:
-        row_data = sheet.row_values(row)
-        if len(row_data) >= 13:
-            return row_data[12]   # index 12 = column 13
-    return "MENU"
+    def succeeded(self, phone, kind):
+        with self.cond:
+            self.attempts.pop((phone, kind), None)
 
+    def rebuild(self):
+        # Reload every unsent job from the lead store (on startup)
+        count = 0
 
-def set_user_state(phone, state_value):
-    row = find_row_by_phone(phone)
+        for row in lead_store.iter_leads():
+            phone = clean_number(row[0])
+            if not phone or is_web_lead(phone):
+                continue
 
-    if not row:
-        save_or_update_lead(phone=phone)
-        row = find_row_by_phone(phone)
+            for kind, (time_col, sent_col) in REMINDER_KINDS.items():
+                due = row[time_col - 1].strip()
 
-    if row:
-        sheet.update_cell(row, 13, state_value)
+                if due and row[sent_col - 1] == "NO":
+                    try:
+                        self.schedule(phone, kind, datetime.strptime(due, REMINDER_TIME_FORMAT))
+                        count += 1
+                    except ValueError:
+                        log_event("bad_reminder_time", logging.WARNING, phone=phone, kind=kind, due=due)
 
+        log_event("reminders_scheduled", jobs=count)
 
-def lead_scoring(message):
-    msg = message.lower()
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+            self.thread.start()
 
-    cold_words = ["test", "testing", "just checking", "wrong", "mistake", "ignore"]
-    hot_words = ["fees", "price", "membership", "join", "trial", "visit", "location", "timing", "book"]
+    def _is_live(self, entry):
+        due_ts, phone, kind = entry
+        return self.jobs.get((phone, kind)) == due_ts
 
-    if any(w in msg for w in cold_words):
-        return "COLD"
+    def pop_due(self):
+        now = time.time()
+        due = []
 
-    score = sum(1 for w in hot_words if w in msg)
+        with self.cond:
+            while self.heap and self.heap[0][0] <= now:
+                entry = heapq.heappop(self.heap)
 
-    if score >= 2:
-        return "HOT"
-    elif score == 1:
-        return "WARM"
-    else:
-        return "COLD"
+                if self._is_live(entry):
+                    del self.jobs[(entry[1], entry[2])]
+                    due.append(entry)
 
+        return due
 
-def find_row_by_phone(phone):
-    phone = clean_number(phone)
+    def _wait_until_due(self):
+        with self.cond:
+            while True:
+                while self.heap and not self._is_live(self.heap[0]):
+                    heapq.heappop(self.heap)
 
-    try:
-        all_rows = sheet.get_all_values()
+                if not self.heap:
+                    self.cond.wait()
+                    continue
 
-        for i in range(1, len(all_rows)):
-            if len(all_rows[i]) > 0 and clean_number(all_rows[i][0]) == phone:
-                return i + 1
+                delay = self.heap[0][0] - time.time()
+                if delay <= 0:
+                    return
 
-        return None
+                self.cond.wait(delay)
 
-    except Exception as e:
-        print("❌ Error finding row:", e)
-        return None
+    def _run(self):
+        while True:
+            self._wait_until_due()
 
+            with sheets_priority(BACKGROUND):
+                reminder_checker()
 
-def save_or_update_lead(phone, name="", interest="", lead_type="COLD", trial_status="", last_message=""):
-    phone = clean_number(phone)
 
-    try:
-        row = find_row_by_phone(phone)
+def send_due_job(phone, kind, name):
+    if kind == "reminder":
+        text = reminder_message(phone, name)
+    else:
+        text = gupshup_send_review_template(phone, name)
 
-        if row:
-            # Only update fields if value is provided
-            if name:
-                sheet.update_cell(row, 2, name)
+    return gupshup_accepted(text)
 
-            if interest:
-                sheet.update_cell(row, 3, interest)
 
-            if lead_type:
-                sheet.update_cell(row, 4, lead_type)
+class SentFlags:
+    # "Sent" flags for reminders that went out but are not saved in the lead
+    # store yet. They are written in one batch per pass. If that write fails
+    # they stay here for the next pass, and the jobs are not sent again
+    # meanwhile.
 
-            if trial_status:
-                sheet.update_cell(row, 5, trial_status)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}    # phone -> {sent column: "YES"}
 
-            if last_message:
-                sheet.update_cell(row, 6, last_message)
+    def add(self, phone, col):
+        with self.lock:
+            self.pending.setdefault(phone, {})[col] = "YES"
 
-            # Always update timestamp
-            sheet.update_cell(row, 7, now_str())
+    def has(self, phone, col):
+        with self.lock:
+            return col in self.pending.get(phone, {})
 
-            print(f"✅ Updated lead row for {phone}")
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
 
-        else:
-            # Create new row
-            sheet.append_row([
-                phone,
-                name,
-                interest,
-                lead_type,
-                trial_status,
-                last_message,
-                now_str()
-            ])
-
-            print(f"🎯 New lead saved for {phone}")
+            try:
+                lead_store.update_many(self.pending)
+                log_event("sent_flags_saved", leads=len(self.pending))
+                self.pending = {}
+            except Exception as e:
+                log_event("sent_flags_failed", logging.ERROR, leads=len(self.pending), error=str(e))
 
-    except Exception as e:
-        print("❌ Error saving lead:", e)
 
+class ReminderOutbox:
+    # Trials booked on a worker that does not run the scheduler are handed
+    # to the one that does through this table.
 
-# ============================================================
-#                 GUPSHUP SEND FUNCTIONS
-# ============================================================
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
 
-def gupshup_send_text(to, text):
-    to = clean_number(to)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS reminder_outbox "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, phone TEXT NOT NULL, "
+                "kind TEXT NOT NULL, due_ts REAL NOT NULL)"
+            )
 
-    headers = {
-        "apikey": GUPSHUP_API_KEY,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+    def add(self, phone, kind, due):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO reminder_outbox (phone, kind, due_ts) VALUES (?, ?, ?)",
+                (phone, kind, due.timestamp())
+            )
 
-    msg = json.dumps({
-        "type": "text",
-        "text": text
-    })
-
-    payload = {
-        "channel": "whatsapp",
-        "source": clean_number(GUPSHUP_SOURCE_NUMBER),
-        "destination": to,
-        "message": msg,
-        "src.name": GUPSHUP_APP_NAME
-    }
+    def take(self):
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT id, phone, kind, due_ts FROM reminder_outbox ORDER BY id"
+            ).fetchall()
 
-    r = requests.post(GUPSHUP_SEND_URL, headers=headers, data=payload)
-    print("📤 SEND TEXT:", r.status_code, r.text)
-    return r.text
+            if rows:
+                self.conn.execute("DELETE FROM reminder_outbox WHERE id <= ?", (rows[-1][0],))
 
+        return [(phone, kind, datetime.fromtimestamp(due_ts)) for _, phone, kind, due_ts in rows]
 
-def gupshup_send_image(to, image_url, caption=""):
-    to = clean_number(to)
 
-    headers = {
-        "apikey": GUPSHUP_API_KEY,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+def queue_reminder(phone, kind, due):
+    if scheduler_lock.held:
+        reminder_scheduler.schedule(phone, kind, due)
+    else:
+        reminder_outbox.add(phone, kind, due)
 
-    msg = {
-        "type": "image",
-        "originalUrl": image_url,
-        "previewUrl": image_url,
-        "caption": caption
-    }
 
-    payload = {
-        "channel": "whatsapp",
-        "source": clean_number(GUPSHUP_SOURCE_NUMBER),
-        "destination": to,
-        "message": json.dumps(msg),
-        "src.name": GUPSHUP_APP_NAME
-    }
+def sync_reminder_outbox():
+    for phone, kind, due in reminder_outbox.take():
+        reminder_scheduler.schedule(phone, kind, due)
 
-    r = requests.post(GUPSHUP_SEND_URL, headers=headers, data=payload)
-    print("📤 SEND IMAGE:", r.status_code, r.text)
-    return r.text
 
-def gupshup_send_trial_buttons(to, name):
-    to = clean_number(to)
+def claim_due_jobs(due):
+    jobs = []
 
-    headers = {
-        "apikey": GUPSHUP_API_KEY,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+    for due_ts, phone, kind in due:
+        time_col, sent_col = REMINDER_KINDS[kind]
 
-    msg = {
-        "type": "quick_reply",
-        "content": {
-            "type": "text",
-            "text": f"Nice {name} 😊\nAap kab visit karna chahoge?"
-        },
-        "options": [
-            {"title": "📅 Today", "postbackText": "visit_today"},
-            {"title": "📅 Tomorrow", "postbackText": "visit_tomorrow"},
-            {"title": "📅 Some Other Day", "postbackText": "visit_other"}
-        ]
-    }
+        try:
+            row = lead_store.get(phone)
+        except Exception as e:
+            log_event("reminder_lookup_failed", logging.ERROR, phone=phone, kind=kind, error=str(e))
+            reminder_scheduler.retry(phone, kind)
+            continue
 
-    payload = {
-        "channel": "whatsapp",
-        "source": clean_number(GUPSHUP_SOURCE_NUMBER),
-        "destination": to,
-        "message": json.dumps(msg),
-        "src.name": GUPSHUP_APP_NAME
-    }
+        # Skip jobs that were already sent or cancelled since they were queued
+        if not row or row[sent_col - 1] != "NO" or sent_flags.has(phone, sent_col):
+            continue
 
-    r = requests.post(GUPSHUP_SEND_URL, headers=headers, data=payload)
-    print("📤 TRIAL BUTTONS:", r.status_code, r.text)
-    return r.text
+        jobs.append((phone, kind, row[COL_NAME - 1]))
 
+    return jobs
 
 
-def gupshup_send_buttons(to):
-    headers = {
-        "apikey": GUPSHUP_API_KEY,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+def reminder_checker():
 
-    msg = {
-        "type": "quick_reply",
-        "content": {
-            "type": "text",
-            "text": WELCOME_TEXT
-        },
-        "options": [
-            {"title": "💰 Fees", "postbackText": "FEES"},
-            {"title": "🎁 Free Trial", "postbackText": "TRIAL"},
-            {"title": "⏰ Timings", "postbackText": "TIMINGS"}
-        ]
-    }
+    with metrics.timer("reminder_checker_seconds"):
+        jobs = claim_due_jobs(reminder_scheduler.pop_due())
+        futures = [(job, reminder_pool.submit(send_due_job, *job)) for job in jobs]
 
-    payload = {
-        "channel": "whatsapp",
-        "source": clean_number(GUPSHUP_SOURCE_NUMBER),
-        "destination": clean_number(to),
-        "message": json.dumps(msg),
-        "src.name": GUPSHUP_APP_NAME
-    }
+        for (phone, kind, name), future in futures:
+            try:
+                accepted = future.result()
+            except Exception as e:
+                log_event("reminder_send_failed", logging.ERROR, phone=phone, kind=kind, error=str(e))
+                accepted = False
 
-    r = requests.post(GUPSHUP_SEND_URL, headers=headers, data=payload)
-    print("📤 QUICK REPLY MENU:", r.status_code, r.text)
-    return r.text
+            if accepted:
+                sent_flags.add(phone, REMINDER_KINDS[kind][1])
+                reminder_scheduler.succeeded(phone, kind)
+                metrics.inc("reminders_sent_total", kind=kind)
+                log_event("reminder_sent", phone=phone, kind=kind)
+            elif reminder_scheduler.retry(phone, kind):
+                log_event("reminder_retry", logging.WARNING, phone=phone, kind=kind)
+            else:
+                metrics.inc("reminders_failed_total", kind=kind)
+                log_event("reminder_failed", logging.ERROR, phone=phone, kind=kind)
 
+        sent_flags.flush()
 
-def gupshup_send_buttons_2(to):
-    headers = {
-        "apikey": GUPSHUP_API_KEY,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
 
-    msg = {
-        "type": "quick_reply",
-        "content": {
-            "type": "text",
-            "text": "More options 👇"
-        },
-        "options": [
-            {"title": "📍 Location", "postbackText": "LOCATION"},
-            {"title": "🔥 Transformations", "postbackText": "TRANSFORM"},
-            {"title": "🏋️ Gym Photos", "postbackText": "GYM_PHOTOS"}
-        ]
-    }
+reminder_scheduler = ReminderScheduler()
+reminder_pool = ThreadPoolExecutor(max_workers=REMINDER_SEND_WORKERS, thread_name_prefix="reminder-send")
+sent_flags = SentFlags()
+reminder_outbox = ReminderOutbox(DATA_DB_PATH)
 
-    payload = {
-        "channel": "whatsapp",
-        "source": clean_number(GUPSHUP_SOURCE_NUMBER),
-        "destination": clean_number(to),
-        "message": json.dumps(msg),
-        "src.name": GUPSHUP_APP_NAME
-    }
 
-    r = requests.post(GUPSHUP_SEND_URL, headers=headers, data=payload)
-    print("📤 QUICK REPLY MENU2:", r.status_code, r.text)
-    return r.text
+def start_scheduled_jobs():
+    # Runs once, in the worker that holds the scheduler lock
+    with sheets_priority(BACKGROUND):
+        reminder_scheduler.rebuild()
+    sync_reminder_outbox()
+    reminder_scheduler.start()
 
+    scheduler.add_job(sync_reminder_outbox, "interval", seconds=REMINDER_SYNC_SECONDS)
+    scheduler.add_job(sent_flags.flush, "interval", seconds=REMINDER_SYNC_SECONDS)
 
-GUPSHUP_TEMPLATE_URL = "https://api.gupshup.io/wa/api/v1/template/msg"
+    if OWNER_NOTIFY_MODE == "digest":
+        scheduler.add_job(owner_digest.flush, "interval", minutes=OWNER_DIGEST_MINUTES)
 
-def gupshup_send_template(to, template_id, params=None):
-    to = clean_number(to)
+    if RESCORE_INTERVAL_HOURS > 0:
+        scheduler.add_job(rescore_leads, "interval", hours=RESCORE_INTERVAL_HOURS)
 
-    if params is None:
-        params = []
 
-    headers = {
-        "apikey": GUPSHUP_API_KEY,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+def claim_scheduler():
+    if scheduler_lock.held:
+        return
 
-    payload = {
-        "source": clean_number(GUPSHUP_SOURCE_NUMBER),
-        "destination": to,
-        "template": json.dumps({
-            "id": template_id,
-            "params": params
-        })
-    }
+    if scheduler_lock.try_acquire():
+        log_event("scheduler_claimed")
+        start_scheduled_jobs()
 
-    try:
-        r = requests.post(GUPSHUP_TEMPLATE_URL, headers=headers, data=payload)
-        print("📤 TEMPLATE STATUS:", r.status_code)
-        print("📤 TEMPLATE RESPONSE:", r.text)
-        return r.text
-    except Exception as e:
-        print("❌ TEMPLATE ERROR:", e)
-        return None
+# ============================================================
+#                     CAMPAIGNS
+# ============================================================
 
-def notify_owner(text):
-    gupshup_send_text(OWNER_NUMBER, text)
+# Sends an approved template to a segment of leads, e.g. every WARM lead:
+#
+#   START_BACKGROUND_SERVICES=0 flask --app app5 campaign send warm-offer \
+#       --template <template id> --where lead_type=WARM --param "{name}"
+#
+# Leads are streamed from the lead store and sent by a small pool at a
+# capped rate, so it runs beside webhook traffic. Every phone is logged
+# per campaign id, and running the same id again resumes without sending
+# twice to anyone.
+
+# Messages per second, shared by all campaigns and processes
+CAMPAIGN_RATE = float(os.environ.get("CAMPAIGN_RATE", 10))
+CAMPAIGN_WORKERS = int(os.environ.get("CAMPAIGN_WORKERS", 8))
+
+
+def lead_matches(values, where):
+    # where: {field: value}; a value ending in * matches as a prefix
+    for field, expected in where.items():
+        value = values[LEAD_FIELDS.index(field)].strip().lower()
+        expected = expected.strip().lower()
+
+        if expected.endswith("*"):
+            if not value.startswith(expected[:-1]):
+                return False
+        elif value != expected:
+            return False
+
+    return True
+
+
+class CampaignLog:
+    # One row per (campaign, phone). "sending" is written before the send;
+    # a run that dies mid-send leaves it, and the phone is not retried since
+    # the message may have gone out. "failed" phones are retried on resume.
+    # Accepted sends are "sent" until Gupshup's delivery callback turns
+    # them into "delivered" (or "failed").
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = open_db(path)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS campaign_sends "
+                "(campaign_id TEXT NOT NULL, phone TEXT NOT NULL, status TEXT NOT NULL, "
+                "message_id TEXT NOT NULL DEFAULT '', updated REAL NOT NULL, "
+                "PRIMARY KEY (campaign_id, phone))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS campaign_sends_message ON campaign_sends (message_id)"
+            )
+
+    def handled(self, campaign_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT phone FROM campaign_sends WHERE campaign_id = ? AND status != 'failed'",
+                (campaign_id,)
+            ).fetchall()
+        return {phone for phone, in rows}
+
+    def mark(self, campaign_id, phone, status, message_id=""):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO campaign_sends (campaign_id, phone, status, message_id, updated) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (campaign_id, phone, status, message_id, time.time())
+            )
+
+    def record_event(self, message_id, event):
+        # Gupshup message-event callbacks: delivered / read / failed
+        if event in ("delivered", "read"):
+            status = "delivered"
+        elif event == "failed":
+            status = "failed"
+        else:
+            return
 
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE campaign_sends SET status = ?, updated = ? "
+                "WHERE message_id = ? AND status = 'sent'",
+                (status, time.time(), message_id)
+            )
 
-def gupshup_send_review_template(to, name):
-    to = clean_number(to)
+    def counts(self, campaign_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM campaign_sends WHERE campaign_id = ? GROUP BY status",
+                (campaign_id,)
+            ).fetchall()
+        return dict(rows)
 
-    headers = {
-        "apikey": GUPSHUP_API_KEY,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
 
-    payload = {
-        "source": GUPSHUP_SOURCE_NUMBER,
-        "destination": to,
-        "template": json.dumps({
-            "id": "db504bec-4dd8-4f04-978c-4ddaea2ca0c6",   # replace with EXACT template id
-            "params": [name, REVIEW_LINK]     # {{1}} name, {{2}} link
-        })
-    }
+campaign_log = CampaignLog(DATA_DB_PATH)
 
-    r = requests.post(
-        "https://api.gupshup.io/wa/api/v1/template/msg",
-        headers=headers,
-        data=payload
-    )
 
-    print("📤 REVIEW TEMPLATE:", r.status_code, r.text)
-    return r.text
+def run_campaign(campaign_id, template_id, where, params=(), rate=CAMPAIGN_RATE, workers=CAMPAIGN_WORKERS):
+    bucket = TokenBucket(DATA_DB_PATH, "campaign", rate * 60, burst=max(rate, 1))
+    handled = campaign_log.handled(campaign_id)
+    slots = threading.BoundedSemaphore(max(workers, 1) * 2)
+    counts = {"sent": 0, "failed": 0, "skipped": 0}
+    counts_lock = threading.Lock()
+
+    def send_one(phone, values):
+        message_id = ""
 
+        try:
+            fields = dict(zip(LEAD_FIELDS, values))
+            text = gupshup_send_template(phone, template_id, [p.format(**fields) for p in params])
+
+            if gupshup_accepted(text):
+                status = "sent"
+                message_id = json.loads(text).get("messageId", "")
+            else:
+                status = "failed"
+        except Exception as e:
+            log_event("campaign_send_failed", logging.ERROR, campaign=campaign_id, phone=phone, error=str(e))
+            status = "failed"
+        finally:
+            slots.release()
 
+        campaign_log.mark(campaign_id, phone, status, message_id)
+        metrics.inc("campaign_messages_total", campaign=campaign_id, status=status)
 
+        with counts_lock:
+            counts[status] += 1
+            done = counts["sent"] + counts["failed"]
 
+        if done % 100 == 0:
+            log_event("campaign_progress", campaign=campaign_id, done=done)
 
+    log_event("campaign_started", campaign=campaign_id, rate=rate, segment=where)
 
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="campaign") as pool:
+        for values in lead_store.iter_leads():
+            phone = clean_number(values[0])
 
+            if not phone or is_web_lead(phone) or not lead_matches(values, where):
+                continue
 
+            if phone in handled:
+                counts["skipped"] += 1
+                continue
 
+            handled.add(phone)
+            slots.acquire()
+            bucket.acquire(INTERACTIVE)
+            campaign_log.mark(campaign_id, phone, "sending")
+            pool.submit(send_one, phone, values)
 
-# ============================================================
-#                     FOLLOWUP / REMINDER
-# ============================================================
+    log_event("campaign_done", campaign=campaign_id, **counts)
+    return counts
 
-def followup_message(phone):
-    phone = clean_number(phone)
 
-    text = f"""👋 Hi! Quick follow-up from *{GYM_NAME}* 💪
+@app.cli.group(help="Send approved templates to segments of leads.")
+def campaign():
+    pass
 
-Aap membership / free trial ke liye interested the 😊
 
-Agar aap chahein toh main free trial slot book kar sakta hoon.
+@campaign.command("send", help="Send (or resume) campaign CAMPAIGN_ID.")
+@click.argument("campaign_id")
+@click.option("--template", "template_id", required=True, help="Approved Gupshup template id.")
+@click.option("--where", multiple=True, help="field=value to match, e.g. lead_type=WARM; value* for a prefix.")
+@click.option("--param", "params", multiple=True, help="Template parameter, may use lead fields like {name}.")
+@click.option("--rate", type=float, default=CAMPAIGN_RATE, show_default=True, help="Messages per second.")
+@click.option("--workers", type=int, default=CAMPAIGN_WORKERS, show_default=True)
+def campaign_send(campaign_id, template_id, where, params, rate, workers):
+    segment = {}
 
-Reply *TRIAL* to book."""
-    gupshup_send_text(phone, text)
+    for condition in where:
+        field, sep, value = condition.partition("=")
+        if not sep or field not in LEAD_FIELDS:
+            raise click.BadParameter(f"expected one of {', '.join(LEAD_FIELDS)}=value", param_hint="--where")
+        segment[field] = value
 
+    counts = run_campaign(campaign_id, template_id, segment, params, rate, workers)
+    click.echo(f"sent={counts['sent']} failed={counts['failed']} skipped={counts['skipped']}")
 
-def reminder_message(phone, name=""):
-    phone = clean_number(phone)
 
-    # Send approved template
-    gupshup_send_template(
-        phone,
-        "09d6c1db-a107-4621-8543-4a7a608c9919",
-        [name]   # {{1}} variable
-    )
+@campaign.command("status", help="Show delivery counts for CAMPAIGN_ID.")
+@click.argument("campaign_id")
+def campaign_status(campaign_id):
+    counts = campaign_log.counts(campaign_id)
 
-def reminder_checker():
+    if not counts:
+        click.echo(f"No sends recorded for {campaign_id}")
+    for status, count in sorted(counts.items()):
+        click.echo(f"{status}: {count}")
 
-    print("🔄 Checking reminders...")
 
-    rows = sheet.get_all_values()
-    if not rows or len(rows) < 2:
-        return
-    now = datetime.now()
 
-    for i in range(1, len(rows)):
+# ============================================================
+#                     LEAD RESCORING
+# ============================================================
 
+# The per-message score only ever goes up. This job recomputes every lead's
+# type from its whole row:
+#   last message     HOT 3, WARM 2 (same keywords as the live classifier)
+#   interest         a free trial +3
+#   trial flow       +3 while the lead is mid-booking (ASK_NAME / ASK_VISIT_TIME)
+#   trial status     confirmed +4, booked +3
+#   trial upcoming   +1 (reminder not sent yet), review sent +1
+# then halves the total every RESCORE_HALF_LIFE_DAYS once the lead's last
+# message is older than RESCORE_GRACE_DAYS. HOT from RESCORE_HOT up, WARM
+# from RESCORE_WARM up, else COLD. Within the grace period a lead is never
+# scored below its current type: rescoring only cools down quiet leads.
+RESCORE_HALF_LIFE_DAYS = float(os.environ.get("RESCORE_HALF_LIFE_DAYS", 14))
+RESCORE_GRACE_DAYS = float(os.environ.get("RESCORE_GRACE_DAYS", 1))
+RESCORE_HOT = float(os.environ.get("RESCORE_HOT", 3))
+RESCORE_WARM = float(os.environ.get("RESCORE_WARM", 1.5))
+RESCORE_INTERVAL_HOURS = float(os.environ.get("RESCORE_INTERVAL_HOURS", 6))
+RESCORE_BATCH = int(os.environ.get("RESCORE_BATCH", 5000))
+
+# A new type is only written while these still hold what was scored. Every
+# message sets the timestamp and last message, so a lead that wrote in
+# while the batch ran keeps the type its message gave it.
+RESCORE_GUARD_COLUMNS = (COL_LEAD_TYPE, COL_INTEREST, COL_TRIAL_STATUS, COL_LAST_MESSAGE, COL_TIMESTAMP)
+
+MESSAGE_POINTS = {"HOT": 3.0, "WARM": 2.0, "COLD": 0.0}
+TRIAL_INTEREST_POINTS = 3
+TRIAL_FLOW_POINTS = 3
+TRIAL_FLOW_STATES = ("ASK_NAME", "ASK_VISIT_TIME")
+
+
+# Last messages and timestamps repeat a lot, so each is worked out once
+_message_points_cache = {}
+_timestamp_cache = {}
+
+
+def _message_points(message):
+    cache = _message_points_cache
+    points = cache.get(message)
+    if points is None:
+        intent = classify_message(message)
+        points = MESSAGE_POINTS[intent.lead_type]
+        if intent.warm and not points:
+            points = MESSAGE_POINTS["WARM"]
+        if len(cache) < 50000:
+            cache[message] = points
+    return points
+
+
+def _age_days(timestamp, now):
+    cache = _timestamp_cache
+    ts = cache.get(timestamp)
+    if ts is None:
         try:
-            # Safety check (very important)
-            if len(rows[i]) < 13:
-                continue
-
-            phone = clean_number(rows[i][0])
+            ts = datetime.strptime(timestamp, "%d-%m-%Y %H:%M").timestamp()
+        except ValueError:
+            ts = 0.0
+        if len(cache) < 200000:
+            cache[timestamp] = ts
+    return max(now - ts, 0) / 86400 if ts else None
+
+
+def score_leads(rows, now, in_flow=frozenset()):
+    # One batch, column by column. Returns the lead type for each row.
+    # in_flow: phones mid-way through booking a trial.
+    messages = [r[COL_LAST_MESSAGE - 1].lower().strip() for r in rows]
+    trials = [r[COL_TRIAL_STATUS - 1] for r in rows]
+
+    scores = [_message_points(m) for m in messages]
+    scores = [
+        s + (4 if t == "Trial Confirmed" else 3 if t.startswith("Trial booked") else 0)
+        for s, t in zip(scores, trials)
+    ]
+    scores = [
+        s + ("trial" in r[COL_INTEREST - 1].lower()) * TRIAL_INTEREST_POINTS
+        + (r[COL_PHONE - 1] in in_flow) * TRIAL_FLOW_POINTS
+        for s, r in zip(scores, rows)
+    ]
+    scores = [
+        s + (r[COL_REMINDER_TIME - 1] != "" and r[COL_REMINDER_SENT - 1] == "NO")
+        + (r[COL_REVIEW_SENT - 1] == "YES")
+        for s, r in zip(scores, rows)
+    ]
+
+    ages = [_age_days(r[COL_TIMESTAMP - 1], now) for r in rows]
+    scores = [
+        s * 0.5 ** (max(a - RESCORE_GRACE_DAYS, 0) / RESCORE_HALF_LIFE_DAYS) if a is not None else s
+        for s, a in zip(scores, ages)
+    ]
+
+    types = ["HOT" if s >= RESCORE_HOT else "WARM" if s >= RESCORE_WARM else "COLD" for s in scores]
+
+    # The row only holds the last message; within the grace period the
+    # stored type stands in for the earlier ones, so it is never lowered
+    return [
+        max(t, r[COL_LEAD_TYPE - 1], key=lambda v: LEAD_TYPE_RANK.get(v, -1))
+        if a is not None and a < RESCORE_GRACE_DAYS else t
+        for t, r, a in zip(types, rows, ages)
+    ]
+
+
+def rescore_leads(dry_run=False):
+    started = time.perf_counter()
+    now = time.time()
+    changes = {}
+    total = 0
+    batch = []
+
+    in_flow = session_store.in_states(TRIAL_FLOW_STATES)
+
+    def flush_batch():
+        for row, lead_type in zip(batch, score_leads(batch, now, in_flow)):
+            if row[COL_LEAD_TYPE - 1] != lead_type:
+                changes[clean_number(row[0])] = (row, lead_type)
+        batch.clear()
+
+    with sheets_priority(BACKGROUND):
+        for values in lead_store.iter_leads():
+            phone = clean_number(values[0])
             if not phone:
                 continue
-            reminder_time = rows[i][7]
-            reminder_sent = rows[i][8]
-            review_time = rows[i][9]
-            review_sent = rows[i][10]
 
-            # ================= REMINDER CHECK =================
-            if reminder_time and reminder_sent == "NO":
+            values = lead_cells(values)
+            values[COL_PHONE - 1] = phone
+            batch.append(values)
+            total += 1
 
-                reminder_dt = datetime.strptime(reminder_time.strip(), "%Y-%m-%d %H:%M")
+            if len(batch) >= RESCORE_BATCH:
+                flush_batch()
 
-                if now >= reminder_dt:
-                    name = rows[i][1]
+        flush_batch()
 
-                    reminder_message(phone, name)
+        applied = 0 if dry_run or not changes else lead_store.update_lead_types(changes)
 
-                    sheet.update_cell(i+1, 9, "YES")  # ReminderSent
-                    print(f"✅ Reminder sent to {phone}")
+    seconds = round(time.perf_counter() - started, 2)
+    log_event("leads_rescored", leads=total, changed=len(changes), applied=applied, seconds=seconds, dry_run=dry_run)
+    return {"leads": total, "changed": len(changes), "applied": applied, "seconds": seconds}
 
-            # ================= REVIEW CHECK =================
-            if review_time and review_sent == "NO":
 
-                review_dt = datetime.strptime(review_time.strip(), "%Y-%m-%d %H:%M")
+@app.cli.group(help="Lead maintenance.")
+def leads():
+    pass
 
-                if now >= review_dt:
-                    name = rows[i][1]
 
-                    gupshup_send_review_template(phone, name)
+@leads.command("rescore", help="Recompute every lead's type from its history.")
+@click.option("--dry-run", is_flag=True, help="Only count the changes.")
+def leads_rescore(dry_run):
+    result = rescore_leads(dry_run=dry_run)
+    click.echo(" ".join(f"{k}={v}" for k, v in result.items()))
 
-                    sheet.update_cell(i+1, 11, "YES")  # ReviewSent
-                    print(f"⭐ Review sent to {phone}")
 
-        except Exception as e:
-            print("Reminder loop error:", e)
-scheduler.add_job(reminder_checker, "interval", minutes=5)
 # ============================================================
 #                     BOT LOGIC
 # ============================================================
 
 def process_message(user_phone, user_message, button_id=None):
+    started = time.perf_counter()
+
+    # All sheet writes of one turn go out in a single batch at the end
+    with metrics.timer("process_message_seconds"), sheet_write_batch():
+        lead = LeadContext.load(user_phone)
+
+        try:
+            result = handle_message(lead, user_message, button_id=button_id)
+        finally:
+            lead.save()
+
+    log_event(
+        "message_handled",
+        phone=lead.phone,
+        intent=lead.intent,
+        reply=result["type"],
+        lead_type=lead.get(COL_LEAD_TYPE),
+        ms=round((time.perf_counter() - started) * 1000, 1)
+    )
+    return result
+
+
+def handle_message(lead, user_message, button_id=None):
 
-    user_phone = clean_number(user_phone)
-    state = get_user_state(user_phone)
-    print("CURRENT STATE:", state)
+    user_phone = lead.phone
+    state = lead.state
 
     msg = user_message.lower().strip() if user_message else ""
 
@@ -586,34 +3218,29 @@ def process_message(user_phone, user_message, button_id=None):
         msg = button_id.lower().strip()
 
     # ---------------- LEAD SCORING ----------------
-    lead_type = lead_scoring(msg)
+    # One pass over the message gives both the score and the info intent
+    intent = classify_message(msg)
+    lead_type = intent.lead_type
+    lead.intent = intent.intent
 
     if state in ["ASK_NAME", "ASK_VISIT_TIME"]:
         lead_type = "HOT"
 
-    if any(word in msg for word in ["fees", "timings", "location", "review", "transform"]):
+    if intent.warm:
         if lead_type == "COLD":
             lead_type = "WARM"
 
     # Save/update basic lead activity
-    save_or_update_lead(
-        phone=user_phone,
+    lead.update(
         lead_type=lead_type,
         last_message=user_message
     )
 
     # ---------------- OWNER NOTIFICATION ----------------
     try:
-        owner_msg = f"""🔔 New Lead Activity
-
-📱 Phone: {user_phone}
-💬 Message: {user_message}
-🔥 Lead Type: {lead_type}
-⏰ Time: {now_str()}
-"""
-        notify_owner(owner_msg)
+        notify_owner_activity(user_phone, user_message, lead_type)
     except Exception as e:
-        print("Owner notification error:", e)
+        log_event("owner_notify_failed", logging.ERROR, error=str(e))
 
     # =====================================================
     # ===================== TRIAL FLOW =====================
@@ -621,7 +3248,7 @@ def process_message(user_phone, user_message, button_id=None):
 
     # Step 1: User typed TRIAL
     if msg in ["trial", "free trial", "book trial"]:
-        set_user_state(user_phone, "ASK_NAME")
+        lead.state = "ASK_NAME"
         return {"type": "text", "text": "Great! 💪 Aapka naam kya hai?"}
 
     # Step 2: Asking Name
@@ -629,15 +3256,14 @@ def process_message(user_phone, user_message, button_id=None):
 
         name = extract_name(user_message)
 
-        save_or_update_lead(
-            phone=user_phone,
+        lead.update(
             name=name,
             interest="Free Trial",
             lead_type="HOT",
             last_message=user_message
         )
 
-        set_user_state(user_phone, "ASK_VISIT_TIME")
+        lead.state = "ASK_VISIT_TIME"
 
         return {
             "type": "trial_buttons",
@@ -658,8 +3284,7 @@ def process_message(user_phone, user_message, button_id=None):
 
         trial_status = f"Trial booked - {visit_time}"
 
-        save_or_update_lead(
-            phone=user_phone,
+        lead.update(
             interest="Free Trial Booking",
             lead_type="HOT",
             trial_status=trial_status,
@@ -677,15 +3302,20 @@ def process_message(user_phone, user_message, button_id=None):
             reminder_delay = 48
             review_delay = 168
 
-        reminder_time = (datetime.now() + timedelta(hours=reminder_delay)).strftime("%Y-%m-%d %H:%M")
-        review_time = (datetime.now() + timedelta(hours=review_delay)).strftime("%Y-%m-%d %H:%M")
+        # Minute precision, same as what is stored in the sheet
+        booked_at = datetime.now().replace(second=0, microsecond=0)
+        reminder_at = booked_at + timedelta(hours=reminder_delay)
+        review_at = booked_at + timedelta(hours=review_delay)
+
+        # Website visitors cannot get WhatsApp templates
+        if not is_web_lead(user_phone):
+            lead.set(COL_REMINDER_TIME, reminder_at.strftime(REMINDER_TIME_FORMAT))
+            lead.set(COL_REMINDER_SENT, "NO")
+            lead.set(COL_REVIEW_TIME, review_at.strftime(REMINDER_TIME_FORMAT))
+            lead.set(COL_REVIEW_SENT, "NO")
 
-        row = find_row_by_phone(user_phone)
-        if row:
-            sheet.update_cell(row, 8, reminder_time)
-            sheet.update_cell(row, 9, "NO")
-            sheet.update_cell(row, 10, review_time)
-            sheet.update_cell(row, 11, "NO")
+            queue_reminder(user_phone, "reminder", reminder_at)
+            queue_reminder(user_phone, "review", review_at)
 
         # Owner trial notification
         try:
@@ -697,9 +3327,9 @@ def process_message(user_phone, user_message, button_id=None):
 """
             notify_owner(owner_trial_msg)
         except Exception as e:
-            print("Owner trial notify error:", e)
+            log_event("owner_notify_failed", logging.ERROR, kind="trial", error=str(e))
 
-        set_user_state(user_phone, "MENU")
+        lead.state = "MENU"
 
         return {
             "type": "text",
@@ -721,41 +3351,39 @@ Reply *MENU* anytime for options."""
 
 # Only greeting → send welcome text only
     if msg in ["hi", "hello", "hey"]:
-        set_user_state(user_phone, "MENU")
+        lead.state = "MENU"
         return {"type": "menu"}
 # Explicit MENU request → send buttons
     if msg in ["menu", "start", "or bhai"]:
 
-        row = find_row_by_phone(user_phone)
-
-        if not row:
-            save_or_update_lead(phone=user_phone)
-            set_user_state(user_phone, "MENU")
+        if not lead.exists:
+            lead.update()
+            lead.state = "MENU"
             return {"type": "menu"}
 
-        set_user_state(user_phone, "MENU")
+        lead.state = "MENU"
         return {"type": "menu_repeat"}
 
     # =====================================================
     # ================= INFORMATION ========================
     # =====================================================
 
-    if any(word in msg for word in ["fees", "fee", "price", "membership", "plans"]):
+    if intent.intent == "fees":
         return {"type": "text", "text": FEES_TEXT}
 
-    if any(word in msg for word in ["timings", "timing", "time", "open"]):
+    if intent.intent == "timings":
         return {"type": "text", "text": TIMINGS_TEXT}
 
-    if any(word in msg for word in ["location", "address", "where", "jagah"]):
+    if intent.intent == "location":
         return {"type": "text", "text": LOCATION_TEXT}
 
-    if "review" in msg:
+    if intent.intent == "review":
         return {"type": "text", "text": REVIEW_TEXT}
 
-    if any(word in msg for word in ["photo", "image", "photos", "images"]):
+    if intent.intent == "photos":
         return {"type": "gym_images"}
 
-    if any(word in msg for word in ["transform", "result"]):
+    if intent.intent == "transform":
         return {"type": "transformations"}
 
     # =====================================================
@@ -764,25 +3392,16 @@ Reply *MENU* anytime for options."""
 
     if msg in ["yes", "confirm_visit", "confirm"]:
 
-        row = find_row_by_phone(user_phone)
-
-        if row:
-            row_data = sheet.row_values(row)
-            sheet_status = row_data[4] if len(row_data) >= 5 else ""
-        else:
-            sheet_status = ""
-
-        if not sheet_status.startswith("Trial booked"):
+        if not lead.trial_status.startswith("Trial booked"):
             return {"type": "text", "text": "🙂 Please type MENU to see options."}
 
-        save_or_update_lead(
-            phone=user_phone,
+        lead.update(
             lead_type="HOT",
             trial_status="Trial Confirmed",
             last_message="Visit Confirmed via Reminder"
         )
 
-        set_user_state(user_phone, "MENU")
+        lead.state = "MENU"
 
         try:
             owner_confirm_msg = f"""✅ TRIAL CONFIRMED!
@@ -792,7 +3411,7 @@ Reply *MENU* anytime for options."""
 """
             notify_owner(owner_confirm_msg)
         except Exception as e:
-            print("Owner confirm notify error:", e)
+            log_event("owner_notify_failed", logging.ERROR, kind="confirm", error=str(e))
 
         return {
             "type": "text",
@@ -819,9 +3438,193 @@ Type MENU anytime 😊"""
     # else:
     #     return {"type": "text", "text": "🙂 Please tap buttons or type MENU to see options."}
 # ============================================================
+#                       STARTUP
+# ============================================================
+
+# Nothing at import talks to Google or starts a thread. Background threads
+# start here, and the Sheets connection (plus the first import into SQLite)
+# is warmed in its own thread with backoff, so a Google outage delays
+# readiness, not worker boot. Until the store is ready, webhook messages are
+# acked and queued and /chat waits briefly. With START_BACKGROUND_SERVICES=0
+# (CLI commands, tests) none of this runs: logs are written inline, and the
+# reply / inbound workers only start if a job is queued.
+START_BACKGROUND_SERVICES = os.environ.get("START_BACKGROUND_SERVICES", "1") == "1"
+WARM_UP_MAX_DELAY = int(os.environ.get("WARM_UP_MAX_DELAY", 60))
+# How long a /chat request waits for warm-up before answering 503
+CHAT_READY_TIMEOUT = float(os.environ.get("CHAT_READY_TIMEOUT", 10))
+
+services_ready = threading.Event()
+startup_status = {"started": False, "sheets": "pending", "store": "pending", "error": ""}
+_startup_lock = threading.Lock()
+
+
+def start_background_services():
+    with _startup_lock:
+        if startup_status["started"]:
+            return
+        startup_status["started"] = True
+
+    start_log_listener()
+    outbound.start()
+    inbound.start()
+
+    scheduler.start()
+    scheduler.add_job(session_store.purge, "interval", minutes=10)
+    scheduler.add_job(metrics.flush, "interval", seconds=METRICS_FLUSH_SECONDS)
+
+    if sheet_mirror:
+        sheet_mirror.start()
+
+    scheduler.add_job(sync_sheet, "interval", seconds=SHEET_SYNC_SECONDS)
+
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def warm_up():
+    # A SQLite store that already holds the sheet can answer messages right
+    # away; the mirror queues sheet writes until the connection comes up.
+    if sheet_mirror and lead_store.is_imported():
+        mark_store_ready()
+
+    delay = 1
+
+    while True:
+        try:
+            with sheets_priority(BACKGROUND):
+                sheet.connect()
+                startup_status["sheets"] = "ok"
+
+                if sheet_mirror and not lead_store.is_imported():
+                    count = lead_store.import_rows(lead_index.snapshot(refresh=True)[1:])
+                    log_event("leads_imported", leads=count)
+            break
+
+        except Exception as e:
+            startup_status["sheets"] = "error"
+            startup_status["error"] = str(e)
+            log_event("warm_up_failed", logging.ERROR, retry_in=delay, error=str(e))
+            time.sleep(delay)
+            delay = min(delay * 2, WARM_UP_MAX_DELAY)
+
+    startup_status["error"] = ""
+    mark_store_ready()
+
+
+def mark_store_ready():
+    if services_ready.is_set():
+        return
+
+    startup_status["store"] = "ok"
+    services_ready.set()
+
+    # Messages a previous worker queued but never got to
+    for sender in inbound_queue.senders():
+        inbound.submit(sender, handle_inbound, sender)
+
+    # Reminders are rebuilt from the store, so only claim once it is usable
+    claim_scheduler()
+    scheduler.add_job(claim_scheduler, "interval", seconds=30)
+
+
+def readiness():
+    status = {
+        "ready": services_ready.is_set(),
+        "sheets": startup_status["sheets"],
+        "store": startup_status["store"],
+        "lead_store": LEAD_STORE,
+        "scheduler": "leader" if scheduler_lock.held else "standby",
+    }
+    if startup_status["error"]:
+        status["error"] = startup_status["error"]
+
+    return status, 200 if status["ready"] else 503
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    status, code = readiness()
+    return jsonify(status), code
+
+# ============================================================
+#                     METRICS ENDPOINT
+# ============================================================
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# ============================================================
 #                WEBSITE CHAT ENDPOINT
 # ============================================================
 
+# Each website visitor gets a session id, sent back in the reply and in a
+# cookie. The widget can return it as "session" in the JSON body, the
+# X-Chat-Session header or the cookie; whichever arrives first is used.
+CHAT_SESSION_COOKIE = "chat_session"
+CHAT_SESSION_ID = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+# A returning visitor keeps the same lead for this long
+CHAT_SESSION_DAYS = int(os.environ.get("CHAT_SESSION_DAYS", 30))
+
+CHAT_COOKIE_OPTIONS = {
+    "max_age": CHAT_SESSION_DAYS * 86400,
+    "httponly": True,
+    "secure": True,
+    "samesite": "None"
+}
+
+
+def chat_session_id(data, header=None, cookie=None):
+    sid = data.get("session") or header or cookie
+
+    if sid and CHAT_SESSION_ID.fullmatch(str(sid)):
+        return str(sid)
+
+    return secrets.token_urlsafe(16)
+
+
+def chat_reply_text(result):
+    # The website widget shows plain text, so buttons become numbered lines
+    if result["type"] == "menu":
+        return WELCOME_TEXT
+
+    if result["type"] == "menu_repeat":
+        return "More options 👇\n📍 Location\n🔥 Transformations\n🏋️ Gym Photos"
+
+    if result["type"] == "trial_buttons":
+        return f"""Nice {result["name"]} 😊
+Aap kab visit karna chahoge?
+1️⃣ Today
+2️⃣ Tomorrow
+3️⃣ Some Other Day"""
+
+    if result["type"] == "transformations":
+        return "🔥 Here are some real transformations from our gym 💪\n" + "\n".join(TRANSFORMATION_IMAGES)
+
+    if result["type"] == "gym_images":
+        return "🏋️ Here are some real photos of our gym 💪🔥\n" + "\n".join(GYM_IMAGES)
+
+    return result["text"]
+
+
+def handle_chat(data, session_id):
+    # Shared by the Flask route and asgi.py; returns (JSON body, status)
+    if not isinstance(data, dict) or "message" not in data:
+        return {"reply": "⚠️ No message received"}, 400
+
+    # The website waits for the reply, so hold it briefly while warming up
+    if not services_ready.wait(CHAT_READY_TIMEOUT):
+        return {"reply": "⏳ We are starting up, please try again in a moment."}, 503
+
+    user_message = data["message"].strip()
+    sender = WEB_LEAD_PREFIX + session_id
+
+    with sender_locks.hold(sender):
+        result = process_message(sender, user_message)
+
+    return {"reply": chat_reply_text(result), "session": session_id}, 200
+
+
 @app.route("/chat", methods=["POST", "GET", "OPTIONS"])
 def chat():
     if request.method == "OPTIONS":
@@ -831,18 +3634,18 @@ def chat():
         return "Chat endpoint is working. Use POST.", 200
 
     data = request.get_json(silent=True)
-    if not data or "message" not in data:
-        return jsonify({"reply": "⚠️ No message received"}), 400
-
-    user_message = data["message"].strip()
-
-    user_id = "website_user"
-    result = process_message(user_id, user_message)
+    session_id = chat_session_id(
+        data if isinstance(data, dict) else {},
+        request.headers.get("X-Chat-Session"),
+        request.cookies.get(CHAT_SESSION_COOKIE)
+    )
 
-    if result["type"] == "menu":
-        return jsonify({"reply": WELCOME_TEXT})
+    body, status = handle_chat(data, session_id)
+    response = jsonify(body)
 
-    return jsonify({"reply": result["text"]})
+    if status == 200:
+        response.set_cookie(CHAT_SESSION_COOKIE, session_id, **CHAT_COOKIE_OPTIONS)
+    return response, status
 
 # ============================================================
 #                GUPSHUP WEBHOOK (FORMAT v2)
@@ -852,15 +3655,33 @@ def chat():
 def gupshup_webhook():
 
     # Gupshup sends JSON
-    data = request.get_json(silent=True)
-    print("📩 FULL DATA RECEIVED:", data)
+    return handle_webhook(request.get_json(silent=True))
+
 
+def handle_webhook(data):
+    # Shared by the Flask route and asgi.py; returns (body, status)
+    log_event("webhook_payload", logging.DEBUG, data=data)
 
     if not data:
+        log_event("webhook_empty", logging.WARNING)
         return "No JSON received", 200
-    # Ignore delivery/read/billing callbacks
+
+    # Delivery / read / billing callbacks outnumber messages; log a sample
+    if data.get("type") != "message" and random.random() < LOG_CALLBACK_SAMPLE:
+        event = data.get("payload") or {}
+        log_event("webhook_callback", type=data.get("type"), status=event.get("type"), sampled=LOG_CALLBACK_SAMPLE)
+
+    # Delivery reports for campaign templates
+    if data.get("type") == "message-event":
+        event = data.get("payload") or {}
+        message_id = event.get("gsId") or event.get("id")
+
+        if message_id:
+            campaign_log.record_event(message_id, event.get("type"))
+        return "OK", 200
+
+    # Ignore read/billing and other callbacks
     if data.get("type") != "message":
-        print("⚠️ Not a user message. Ignoring.")
         return "OK", 200
 
 
@@ -888,31 +3709,55 @@ def gupshup_webhook():
             message_text = ""
 
     except Exception as e:
-        print("❌ Parsing error:", e)
+        log_event("webhook_parse_failed", logging.ERROR, error=str(e))
         return "Parse error", 200
 
     if not sender:
-        print("❌ Sender missing FINAL")
+        log_event("webhook_no_sender", logging.WARNING)
         return "No sender", 200
 
     sender = clean_number(sender)
 
-    print("✅ FINAL SENDER:", sender)
-    print("✅ FINAL MESSAGE:", message_text)
-    print("✅ FINAL BUTTON:", button_id)
-    # Prevent duplicate button processing
-    unique_key = f"{sender}-{button_id or message_text}"
+    # Ignore Gupshup re-deliveries of a message we already handled
+    message_id = data["payload"].get("id")
 
-    if last_processed.get(sender) == unique_key:
-        print("⚠️ Duplicate event ignored")
+    if message_id and deduper.is_duplicate(message_id):
+        log_event("webhook_duplicate", phone=sender, message_id=message_id)
         return "OK", 200
 
-    last_processed[sender] = unique_key
+    log_event("message_received", phone=sender, type=msg_type, button=button_id, message_id=message_id)
+
+    # Handle it in the background, after this sender's earlier messages
+    inbound_queue.add(sender, message_text, button_id)
+    inbound.submit(sender, handle_inbound, sender)
+
+    return "OK", 200
+
+
+def handle_inbound(sender):
+    # Until the store is ready messages stay queued; mark_store_ready()
+    # hands every queued sender back to the dispatcher
+    if not services_ready.is_set():
+        return
+
+    # Another worker may already have handled the queued message, then
+    # there is nothing left to take
+    with sender_locks.hold(sender):
+        while True:
+            message = inbound_queue.take(sender)
+            if message is None:
+                return
+
+            message_text, button_id = message
+
+            try:
+                result = process_message(sender, message_text, button_id=button_id)
+                send_reply(sender, result)
+            except Exception as e:
+                log_event("inbound_failed", logging.ERROR, phone=sender, error=str(e))
 
-    # Process message
-    result = process_message(sender, message_text, button_id=button_id)
 
-    # Send response
+def send_reply(sender, result):
     if result["type"] == "menu":
         gupshup_send_buttons(sender)
         gupshup_send_buttons_2(sender)
@@ -923,14 +3768,10 @@ def gupshup_webhook():
         gupshup_send_trial_buttons(sender, result["name"])
 
     elif result["type"] == "transformations":
-        gupshup_send_text(sender, "🔥 Here are some real transformations from our gym 💪")
-        for img_url in TRANSFORMATION_IMAGES:
-            gupshup_send_image(sender, img_url)
+        send_media_album(sender, "🔥 Here are some real transformations from our gym 💪", TRANSFORMATION_IMAGES)
 
     elif result["type"] == "gym_images":
-        gupshup_send_text(sender, "🏋️ Here are some real photos of our gym 💪🔥")
-        for img_url in GYM_IMAGES:
-            gupshup_send_image(sender, img_url)
+        send_media_album(sender, "🏋️ Here are some real photos of our gym 💪🔥", GYM_IMAGES)
 
 
     else:
@@ -938,14 +3779,12 @@ def gupshup_webhook():
 
 
 
-    return "OK", 200
-
-
-
 # ============================================================
 #                       RUN SERVER
 # ============================================================
 
+if START_BACKGROUND_SERVICES:
+    start_background_services()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+# ASGI entry point: the same /gupshup-webhook and /chat as app5.py, for an
+# asyncio server such as uvicorn:
+#
+#   uvicorn asgi:app --workers 2
+#
+# Requests are read and answered on the event loop. The bot logic from
+# app5 (lead store, Sheets, sessions) runs on a bounded thread pool, and
+# WhatsApp replies go out from app5's inbound workers, so a slow Sheets or
+# Gupshup call holds a pool thread, never the loop. One process can keep
+# hundreds of conversations in flight.
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+
+from werkzeug.http import dump_cookie
+
+import app5
+
+
+# ============================================================
+#                     CONFIG
+# ============================================================
+
+# Threads running app5's blocking handlers
+ASGI_WORKER_THREADS = int(os.environ.get("ASGI_WORKER_THREADS", 32))
+
+# Larger request bodies are refused
+ASGI_MAX_BODY = int(os.environ.get("ASGI_MAX_BODY", 1024 * 1024))
+
+executor = ThreadPoolExecutor(max_workers=ASGI_WORKER_THREADS, thread_name_prefix="asgi")
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type, X-Chat-Session"),
+]
+
+
+# ============================================================
+#                     HELPERS
+# ============================================================
+
+async def run_blocking(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, fn, *args)
+
+
+async def read_body(receive):
+    body = b""
+
+    while True:
+        message = await receive()
+
+        if message["type"] == "http.disconnect":
+            return None
+
+        body += message.get("body", b"")
+        if len(body) > ASGI_MAX_BODY:
+            return None
+
+        if not message.get("more_body"):
+            return body
+
+
+def parse_json(body):
+    # Same as Flask's get_json(silent=True)
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+def request_headers(scope):
+    return {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+
+
+def request_cookie(headers, name):
+    cookie = SimpleCookie()
+
+    try:
+        cookie.load(headers.get("cookie", ""))
+    except Exception:
+        return None
+
+    return cookie[name].value if name in cookie else None
+
+
+async def respond(send, status, body, content_type="text/plain; charset=utf-8", headers=()):
+    if not isinstance(body, bytes):
+        body = body.encode()
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ] + CORS_HEADERS + list(headers)
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def respond_json(send, status, data, headers=()):
+    body = json.dumps(data, ensure_ascii=False).encode()
+    await respond(send, status, body, "application/json", headers)
+
+
+# ============================================================
+#                     ROUTES
+# ============================================================
+
+async def gupshup_webhook(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return await respond(send, 413, "Request too large")
+
+    text, status = await run_blocking(app5.handle_webhook, parse_json(body))
+    await respond(send, status, text)
+
+
+async def chat(scope, receive, send):
+    if scope["method"] == "GET":
+        return await respond(send, 200, "Chat endpoint is working. Use POST.")
+
+    body = await read_body(receive)
+    if body is None:
+        return await respond(send, 413, "Request too large")
+
+    data = parse_json(body)
+    headers = request_headers(scope)
+    session_id = app5.chat_session_id(
+        data if isinstance(data, dict) else {},
+        headers.get("x-chat-session"),
+        request_cookie(headers, app5.CHAT_SESSION_COOKIE)
+    )
+
+    reply, status = await run_blocking(app5.handle_chat, data, session_id)
+
+    cookie = []
+    if status == 200:
+        value = dump_cookie(app5.CHAT_SESSION_COOKIE, session_id, **app5.CHAT_COOKIE_OPTIONS)
+        cookie.append((b"set-cookie", value.encode("latin-1")))
+
+    await respond_json(send, status, reply, cookie)
+
+
+async def ready(scope, receive, send):
+    status, code = app5.readiness()
+    await respond_json(send, code, status)
+
+
+async def metrics(scope, receive, send):
+    await respond(send, 200, app5.metrics.render(), "text/plain; version=0.0.4")
+
+
+ROUTES = {
+    "/gupshup-webhook": (gupshup_webhook, {"POST"}),
+    "/chat": (chat, {"GET", "POST"}),
+    "/ready": (ready, {"GET"}),
+    "/metrics": (metrics, {"GET"}),
+}
+
+
+# ============================================================
+#                     ASGI APP
+# ============================================================
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            # Let queued messages and replies go out before the process exits
+            await run_blocking(app5.inbound.drain, 10)
+            await run_blocking(app5.outbound.drain, 10)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] != "http":
+        return
+
+    route = ROUTES.get(scope["path"])
+    if route is None:
+        return await respond(send, 404, "Not Found")
+
+    handler, methods = route
+
+    if scope["method"] == "OPTIONS":
+        return await respond(send, 200, "")
+
+    if scope["method"] not in methods:
+        return await respond(send, 405, "Method Not Allowed")
+
+    await handler(scope, receive, send)
@@ -0,0 +1,508 @@
+# Offline end-to-end benchmark for the webhook.
+#
+#   python benchmarks/bench_e2e.py --rows 100,1000,10000,100000 --messages 500
+#   python benchmarks/bench_e2e.py --replay recorded_webhooks.jsonl
+#
+# Runs app5.app in-process against a fake "Gym leads" worksheet and a fake
+# Gupshup endpoint (configurable latency and quota errors), replays
+# synthetic or recorded webhook traffic and reports latency percentiles
+# (webhook ack, and receipt to the reply's first send reaching Gupshup),
+# throughput and Sheets / Gupshup calls per message.
+# Nothing leaves the machine. Each sheet size runs in its own process.
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import parse_qs
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import gspread
+import requests
+from gspread.utils import a1_range_to_grid_range
+from requests.adapters import BaseAdapter
+
+
+HEADER = [
+    "Phone", "Name", "Interest", "LeadType", "TrialStatus", "LastMessage", "Timestamp",
+    "ReminderTime", "ReminderSent", "ReviewTime", "ReviewSent", "Notes", "State"
+]
+
+READ_CALLS = {"get_all_values", "row_values", "get", "batch_get", "get_values"}
+
+
+# ============================================================
+#                     FAKE SHEETS
+# ============================================================
+
+def quota_error():
+    response = requests.Response()
+    response.status_code = 429
+    response._content = json.dumps({"error": {
+        "code": 429,
+        "message": "Quota exceeded for quota metric 'Read requests'",
+        "status": "RESOURCE_EXHAUSTED"
+    }}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+class FakeWorksheet:
+    # Enough of gspread.Worksheet for app5, backed by a list of rows
+
+    def __init__(self, rows, latency, row_cost, error_rate):
+        self.rows = rows
+        self.latency = latency
+        self.row_cost = row_cost
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.errors = 0
+        self.title = "Sheet1"
+        self.id = 0
+        self.version = 0    # bumped on every write, like Drive's modifiedTime
+
+    def _call(self, name, rows_moved=1):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+        time.sleep(self.latency + rows_moved * self.row_cost)
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            raise quota_error()
+
+    def _set(self, row, col, value):
+        self.version += 1
+        while len(self.rows) < row:
+            self.rows.append([""] * len(HEADER))
+        values = self.rows[row - 1]
+        while len(values) < col:
+            values.append("")
+        values[col - 1] = value
+
+    def get_all_values(self, *args, **kwargs):
+        self._call("get_all_values", len(self.rows))
+        with self.lock:
+            return [list(r) for r in self.rows]
+
+    def row_values(self, row, *args, **kwargs):
+        self._call("row_values")
+        with self.lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def get(self, range_name=None, *args, **kwargs):
+        grid = a1_range_to_grid_range(range_name)
+        start = grid.get("startRowIndex", 0)
+        end = grid.get("endRowIndex", len(self.rows))
+        first_col = grid.get("startColumnIndex", 0)
+        last_col = grid.get("endColumnIndex", len(HEADER))
+
+        self._call("get", max(min(end, len(self.rows)) - start, 1))
+        with self.lock:
+            return [list(r[first_col:last_col]) for r in self.rows[start:end]]
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell")
+        with self.lock:
+            self._set(row, col, value)
+
+    def batch_update(self, data, *args, **kwargs):
+        self._call("batch_update", len(data))
+        with self.lock:
+            for item in data:
+                grid = a1_range_to_grid_range(item["range"])
+                for i, values in enumerate(item["values"]):
+                    for j, value in enumerate(values):
+                        self._set(grid["startRowIndex"] + 1 + i, grid["startColumnIndex"] + 1 + j, value)
+        return {}
+
+    def append_row(self, values, *args, **kwargs):
+        return self.append_rows([values], _name="append_row")
+
+    def append_rows(self, rows, *args, _name="append_rows", **kwargs):
+        self._call(_name, len(rows))
+        with self.lock:
+            first = len(self.rows) + 1
+            self.rows.extend(list(r) for r in rows)
+            self.version += 1
+            last = len(self.rows)
+        return {"updates": {"updatedRange": f"Sheet1!A{first}:M{last}"}}
+
+
+class FakeSpreadsheet:
+
+    def __init__(self, worksheet):
+        self.sheet1 = worksheet
+        self.id = "bench"
+        worksheet.spreadsheet = self
+
+    def get_lastUpdateTime(self):
+        return str(self.sheet1.version)
+
+
+class FakeSheetsClient:
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, title):
+        return self.spreadsheet
+
+
+# ============================================================
+#                     FAKE GUPSHUP
+# ============================================================
+
+class FakeGupshupAdapter(BaseAdapter):
+    # Answers every Gupshup POST locally like the real API would
+
+    def __init__(self, latency, error_rate):
+        super().__init__()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.on_send = None   # called with each request's destination number
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.calls += 1
+
+        if self.on_send:
+            body = request.body or ""
+            if isinstance(body, bytes):
+                body = body.decode()
+            self.on_send(parse_qs(body).get("destination", [""])[0])
+
+        time.sleep(self.latency)
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            response.status_code = 429
+            response._content = b'{"status":"error","message":"Too many requests"}'
+        else:
+            response.status_code = 202
+            response._content = json.dumps({"status": "submitted", "messageId": uuid.uuid4().hex}).encode()
+
+        return response
+
+    def close(self):
+        pass
+
+
+# ============================================================
+#                     TRAFFIC
+# ============================================================
+
+def webhook(phone, text=None, button=None):
+    if button:
+        payload = {"type": "button_reply", "payload": {"postbackText": button, "title": text or button}}
+    else:
+        payload = {"type": "text", "payload": {"text": text}}
+
+    payload["id"] = uuid.uuid4().hex
+    payload["sender"] = {"phone": phone, "name": "Bench"}
+    return {"app": "LifestyleShauryaFitnessBot", "type": "message", "payload": payload}
+
+
+SCENARIOS = {
+    "menu": lambda p: [webhook(p, "hi"), webhook(p, "Menu")],
+    "info": lambda p: [webhook(p, "Fees", "FEES"), webhook(p, "what are the timings"), webhook(p, "location")],
+    "photos": lambda p: [webhook(p, "Gym Photos", "GYM_PHOTOS")],
+    "trial": lambda p: [
+        webhook(p, "Free Trial", "TRIAL"),
+        webhook(p, "my name is Bench User"),
+        webhook(p, "Tomorrow", "visit_tomorrow")
+    ],
+    "confirm": lambda p: [webhook(p, "yes")],
+}
+
+
+def synthetic_traffic(count, existing_phones, new_ratio):
+    # A list of conversations, each one phone's messages in order
+    conversations = []
+    total = 0
+    next_new = 0
+
+    while total < count:
+        if existing_phones and random.random() >= new_ratio:
+            phone = random.choice(existing_phones)
+        else:
+            phone = f"9188{next_new:08d}"
+            next_new += 1
+
+        scenario = random.choice(list(SCENARIOS))
+        messages = SCENARIOS[scenario](phone)
+        conversations.append(messages[:count - total])
+        total += len(conversations[-1])
+
+    return conversations
+
+
+def recorded_traffic(path):
+    by_phone = {}
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            phone = (data.get("payload") or {}).get("sender", {}).get("phone", "")
+            by_phone.setdefault(phone, []).append(data)
+
+    return list(by_phone.values())
+
+
+def build_sheet(rows):
+    sheet = [list(HEADER)]
+    for i in range(rows):
+        sheet.append([
+            f"9170{i:08d}", f"Lead {i}", "", random.choice(["COLD", "WARM", "HOT"]),
+            "", "hi", "01-01-2026 10:00", "", "", "", "", "", ""
+        ])
+    return sheet
+
+
+# ============================================================
+#                     RUN
+# ============================================================
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def install_fakes(args, worksheet):
+    # app5 opens the sheet lazily on first use; point it at the fakes
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    os.environ.setdefault("GOOGLE_CREDS_JSON", "{}")
+    os.environ.setdefault("OWNER_NUMBER", "919900000000")
+    os.environ.setdefault("GUPSHUP_API_KEY", "bench")
+    os.environ["LEAD_STORE"] = args.store
+    os.environ["DATA_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-"), "leads.db")
+
+    ServiceAccountCredentials.from_json_keyfile_dict = staticmethod(lambda *a, **k: None)
+    gspread.authorize = lambda creds: FakeSheetsClient(FakeSpreadsheet(worksheet))
+
+
+def run_size(args):
+    random.seed(args.seed)
+
+    worksheet = FakeWorksheet(
+        build_sheet(args.rows[0]),
+        args.sheet_latency_ms / 1000.0,
+        args.sheet_row_us / 1e6,
+        args.sheet_error_rate
+    )
+    adapter = FakeGupshupAdapter(args.gupshup_latency_ms / 1000.0, args.gupshup_error_rate)
+    install_fakes(args, worksheet)
+
+    devnull = open(os.devnull, "w")
+
+    with contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        import app5
+        import_seconds = time.perf_counter() - started
+
+        # The sheet connection and first SQLite import happen in the background
+        app5.services_ready.wait(120)
+        ready_seconds = time.perf_counter() - started
+
+        app5.gupshup.session.mount("https://", adapter)
+
+        if args.replay:
+            conversations = recorded_traffic(args.replay)
+        else:
+            existing = [row[0] for row in worksheet.rows[1:]]
+            conversations = synthetic_traffic(args.messages, existing, args.new_ratio)
+
+        # Calls made while starting up are not part of the per-message cost
+        sheet_calls_before = dict(worksheet.calls)
+        gupshup_calls_before = adapter.calls
+
+        latencies = []
+        latencies_lock = threading.Lock()
+
+        # Reply latency: from the webhook being received to the first send
+        # of its reply reaching Gupshup. One sender's messages are handled
+        # in order, so the k-th message processed for a phone is the k-th
+        # one posted for it.
+        received = {}         # phone -> deque of receipt times not yet processed
+        awaiting_reply = {}   # phone -> receipt time of the reply being sent
+        reply_latencies = []
+        process_message = app5.process_message
+
+        def timed_process_message(sender, *a, **kw):
+            with latencies_lock:
+                queue = received.get(app5.clean_number(sender))
+                t = queue.popleft() if queue else None
+
+            result = process_message(sender, *a, **kw)
+
+            if t is not None:
+                with latencies_lock:
+                    awaiting_reply[app5.clean_number(sender)] = t
+            return result
+
+        def reply_sent(destination):
+            now = time.perf_counter()
+            with latencies_lock:
+                t = awaiting_reply.pop(destination, None)
+                if t is not None:
+                    reply_latencies.append((now - t) * 1000)
+
+        app5.process_message = timed_process_message
+        adapter.on_send = reply_sent
+        pending = list(conversations)
+        pending_lock = threading.Lock()
+
+        def worker():
+            client = app5.app.test_client()
+            while True:
+                with pending_lock:
+                    if not pending:
+                        return
+                    conversation = pending.pop()
+
+                for data in conversation:
+                    payload = data.get("payload") or {}
+                    phone = app5.clean_number((payload.get("sender") or {}).get("phone", ""))
+
+                    t = time.perf_counter()
+                    if data.get("type") == "message" and phone:
+                        with latencies_lock:
+                            received.setdefault(phone, deque()).append(t)
+                    client.post("/gupshup-webhook", json=data)
+                    with latencies_lock:
+                        latencies.append((time.perf_counter() - t) * 1000)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ack_seconds = time.perf_counter() - started
+
+        # Let queued messages, background sends and sheet writes finish
+        app5.inbound.drain(60)
+        app5.outbound.drain(60)
+        if getattr(app5, "sheet_mirror", None):
+            app5.sheet_mirror.flush()
+        total_seconds = time.perf_counter() - started
+
+    messages = len(latencies)
+    sheet_calls = {k: v - sheet_calls_before.get(k, 0) for k, v in worksheet.calls.items()}
+    sheet_reads = sum(v for k, v in sheet_calls.items() if k in READ_CALLS)
+    sheet_writes = sum(v for k, v in sheet_calls.items() if k not in READ_CALLS)
+
+    return {
+        "rows": args.rows[0],
+        "store": args.store,
+        "messages": messages,
+        "import_s": round(import_seconds, 3),
+        "ready_s": round(ready_seconds, 3),
+        "ack_p50_ms": round(percentile(latencies, 50), 2),
+        "ack_p95_ms": round(percentile(latencies, 95), 2),
+        "ack_p99_ms": round(percentile(latencies, 99), 2),
+        "replies": len(reply_latencies),
+        "reply_p50_ms": round(percentile(reply_latencies, 50), 2),
+        "reply_p95_ms": round(percentile(reply_latencies, 95), 2),
+        "reply_p99_ms": round(percentile(reply_latencies, 99), 2),
+        "ack_msg_s": round(messages / ack_seconds, 1) if ack_seconds else 0,
+        "done_msg_s": round(messages / total_seconds, 1) if total_seconds else 0,
+        "sheet_reads_per_msg": round(sheet_reads / messages, 3) if messages else 0,
+        "sheet_writes_per_msg": round(sheet_writes / messages, 3) if messages else 0,
+        "gupshup_per_msg": round((adapter.calls - gupshup_calls_before) / messages, 3) if messages else 0,
+        "sheet_errors": worksheet.errors,
+        "gupshup_errors": adapter.errors,
+        "sheet_calls": sheet_calls,
+    }
+
+
+COLUMNS = [
+    "rows", "messages", "import_s", "ready_s", "ack_p50_ms", "ack_p95_ms", "ack_p99_ms",
+    "replies", "reply_p50_ms", "reply_p95_ms", "reply_p99_ms", "ack_msg_s", "done_msg_s",
+    "sheet_reads_per_msg", "sheet_writes_per_msg", "gupshup_per_msg", "sheet_errors", "gupshup_errors"
+]
+
+
+def print_table(results):
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in COLUMNS]
+    print("  ".join(c.rjust(w) for c, w in zip(COLUMNS, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).rjust(w) for c, w in zip(COLUMNS, widths)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", default="100,1000,10000,100000",
+                        help="comma separated sheet sizes to benchmark")
+    parser.add_argument("--messages", type=int, default=300, help="synthetic messages per size")
+    parser.add_argument("--replay", help="JSONL file of recorded webhook payloads")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel webhook callers")
+    parser.add_argument("--new-ratio", type=float, default=0.3, help="share of conversations from new numbers")
+    parser.add_argument("--store", default="sqlite", choices=["sqlite", "sheet"])
+    parser.add_argument("--sheet-latency-ms", type=float, default=80)
+    parser.add_argument("--sheet-row-us", type=float, default=2, help="transfer cost per row read/written")
+    parser.add_argument("--sheet-error-rate", type=float, default=0.0, help="share of Sheets calls failing with 429")
+    parser.add_argument("--gupshup-latency-ms", type=float, default=150)
+    parser.add_argument("--gupshup-error-rate", type=float, default=0.0, help="share of Gupshup calls answered 429")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print raw JSON results")
+    args = parser.parse_args()
+    args.rows = [int(r) for r in args.rows.split(",")]
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if len(args.rows) == 1:
+        result = run_size(args)
+        print(json.dumps(result) if args.json else result)
+        os._exit(0)   # skip waiting on the app's daemon threads
+
+    results = []
+    for rows in args.rows:
+        cmd = [sys.executable, os.path.abspath(__file__), "--json"]
+        for arg in sys.argv[1:]:
+            if arg != "--json":
+                cmd.append(arg)
+        cmd += ["--rows", str(rows)]
+
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
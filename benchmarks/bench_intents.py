@@ -0,0 +1,107 @@
+# Micro-benchmark: compiled intent classifier vs the old keyword scans.
+#
+#   python benchmarks/bench_intents.py [iterations]
+#
+# Runs both over a mix of realistic WhatsApp / website messages and prints
+# the time per message, the speedup, and the messages they disagree on.
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from intents import classify_message
+
+
+MESSAGES = [
+    "hi",
+    "Hello",
+    "menu",
+    "fees",
+    "timings",
+    "gym_photos",
+    "transform",
+    "location",
+    "visit_today",
+    "yes",
+    "What are the fees for 3 months membership?",
+    "Bhai monthly fee kitni hai aur timing kya hai",
+    "Where is the gym located? Send address please",
+    "Is there any free trial? I want to join and visit tomorrow",
+    "Can I book a trial for sometime next week",
+    "Do you have personal training plans and what is the price",
+    "Send some photos of the gym and transformation results",
+    "Rahul Sharma",
+    "my name is Priya",
+    "Just checking if this number works, testing",
+    "Sorry wrong number",
+    "Gym kab open hota hai subah?",
+    "I will give a review after my first session",
+    "ok thanks",
+    "Kya aapke yahan zumba classes hoti hain? Timings aur fees bata do. Aur jagah kaha hai exactly?",
+]
+
+
+def legacy_classify(msg):
+    # The substring checks process_message used before the classifier
+    cold_words = ["test", "testing", "just checking", "wrong", "mistake", "ignore"]
+    hot_words = ["fees", "price", "membership", "join", "trial", "visit", "location", "timing", "book"]
+
+    if any(w in msg for w in cold_words):
+        lead_type = "COLD"
+    else:
+        score = sum(1 for w in hot_words if w in msg)
+        lead_type = "HOT" if score >= 2 else "WARM" if score == 1 else "COLD"
+
+    warm = any(word in msg for word in ["fees", "timings", "location", "review", "transform"])
+
+    if any(word in msg for word in ["fees", "fee", "price", "membership", "plans"]):
+        intent = "fees"
+    elif any(word in msg for word in ["timings", "timing", "time", "open"]):
+        intent = "timings"
+    elif any(word in msg for word in ["location", "address", "where", "jagah"]):
+        intent = "location"
+    elif "review" in msg:
+        intent = "review"
+    elif any(word in msg for word in ["photo", "image", "photos", "images"]):
+        intent = "photos"
+    elif any(word in msg for word in ["transform", "result"]):
+        intent = "transform"
+    else:
+        intent = None
+
+    return intent, lead_type, warm
+
+
+def run(fn, messages, iterations):
+    def loop():
+        for msg in messages:
+            fn(msg)
+
+    best = min(timeit.repeat(loop, number=iterations, repeat=5))
+    return best / (iterations * len(messages)) * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    messages = [m.lower().strip() for m in MESSAGES]
+
+    legacy_us = run(legacy_classify, messages, iterations)
+    compiled_us = run(classify_message, messages, iterations)
+
+    print(f"messages:  {len(messages)} x {iterations}")
+    print(f"legacy:    {legacy_us:.2f} us/message")
+    print(f"compiled:  {compiled_us:.2f} us/message")
+    print(f"speedup:   {legacy_us / compiled_us:.1f}x")
+
+    print("\nDifferences (legacy -> compiled):")
+    for msg in messages:
+        old = legacy_classify(msg)
+        new = tuple(classify_message(msg))
+        if old != new:
+            print(f"  {msg!r}: {old} -> {new}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import re
+from collections import namedtuple
+
+
+# ============================================================
+#                     KEYWORDS
+# ============================================================
+
+# Each concept is matched as whole words (the forms listed), so "sometime"
+# is no longer "time" and "feedback" is no longer "fee".
+# Tags:
+#   cold   -> lead is COLD (test messages)
+#   hot    -> counts towards the lead score (2+ = HOT, 1 = WARM)
+#   warm   -> lifts a COLD lead to WARM
+#   fees / timings / location / review / photos / transform -> info reply
+KEYWORDS = [
+    ("test", ["test", "tests", "testing"], {"cold"}),
+    ("just_checking", ["just checking"], {"cold"}),
+    ("wrong", ["wrong"], {"cold"}),
+    ("mistake", ["mistake", "mistakes"], {"cold"}),
+    ("ignore", ["ignore", "ignored"], {"cold"}),
+
+    ("fees", ["fees"], {"hot", "warm", "fees"}),
+    ("fee", ["fee"], {"fees"}),
+    ("price", ["price", "prices"], {"hot", "fees"}),
+    ("membership", ["membership", "memberships"], {"hot", "fees"}),
+    ("plans", ["plans"], {"fees"}),
+    ("join", ["join", "joins", "joined", "joining"], {"hot"}),
+    ("trial", ["trial", "trials"], {"hot"}),
+    ("visit", ["visit", "visits", "visited", "visiting"], {"hot"}),
+    ("book", ["book", "books", "booked", "booking"], {"hot"}),
+
+    ("timings", ["timings"], {"hot", "warm", "timings"}),
+    ("timing", ["timing"], {"hot", "timings"}),
+    ("time", ["time", "times"], {"timings"}),
+    ("open", ["open", "opens", "opening"], {"timings"}),
+
+    ("location", ["location", "locations"], {"hot", "warm", "location"}),
+    ("address", ["address", "addresses"], {"location"}),
+    ("where", ["where"], {"location"}),
+    ("jagah", ["jagah"], {"location"}),
+
+    ("review", ["review", "reviews"], {"warm", "review"}),
+
+    ("photo", ["photo", "photos"], {"photos"}),
+    ("image", ["image", "images"], {"photos"}),
+
+    ("transform", ["transform", "transforms", "transformed", "transforming",
+                   "transformation", "transformations"], {"warm", "transform"}),
+    ("result", ["result", "results"], {"transform"}),
+]
+
+# When a message asks several things, the first one here wins
+INFO_INTENTS = ["fees", "timings", "location", "review", "photos", "transform"]
+
+
+# ============================================================
+#                     CLASSIFIER
+# ============================================================
+
+Intent = namedtuple("Intent", ["intent", "lead_type", "warm"])
+
+# A message is split into words in one pass of a compiled regex. Words are
+# looked up in a table built once from KEYWORDS, so the cost is one hash
+# lookup per word instead of one substring scan per keyword. Anything that
+# is not a letter or digit separates words, so "gym_photos" has "photos".
+_WORDS = re.compile(r"[a-z0-9]+")
+
+# concept -> (cold, hot, warm, rank of its info intent or None)
+_CONCEPTS = {}
+# word -> concept
+_WORD_TABLE = {}
+# last word of a phrase -> [(words before it, concept)]
+_PHRASES = {}
+
+for _name, _forms, _tags in KEYWORDS:
+    _intents = [INFO_INTENTS.index(t) for t in _tags if t in INFO_INTENTS]
+    _CONCEPTS[_name] = (
+        "cold" in _tags,
+        "hot" in _tags,
+        "warm" in _tags,
+        min(_intents) if _intents else None
+    )
+
+    for _form in _forms:
+        _words = tuple(_form.split())
+        if len(_words) == 1:
+            _WORD_TABLE[_form] = _name
+        else:
+            _PHRASES.setdefault(_words[-1], []).append((_words[:-1], _name))
+
+
+_KEYWORD_WORDS = frozenset(_WORD_TABLE)
+
+
+def classify_message(msg):
+    # msg is expected lower-cased, like everywhere in process_message
+    words = _WORDS.findall(msg)
+
+    # Set intersection runs in C; only keyword hits reach the Python loop
+    concepts = {_WORD_TABLE[w] for w in _KEYWORD_WORDS.intersection(words)}
+
+    if not _PHRASES.keys().isdisjoint(words):
+        for i, word in enumerate(words):
+            for before, concept in _PHRASES.get(word, ()):
+                if tuple(words[max(i - len(before), 0):i]) == before:
+                    concepts.add(concept)
+
+    cold = warm = False
+    hot = 0
+    rank = None
+
+    for concept in concepts:
+        is_cold, is_hot, is_warm, intent_rank = _CONCEPTS[concept]
+        cold = cold or is_cold
+        warm = warm or is_warm
+        hot += is_hot
+        if intent_rank is not None and (rank is None or intent_rank < rank):
+            rank = intent_rank
+
+    if cold:
+        lead_type = "COLD"
+    elif hot >= 2:
+        lead_type = "HOT"
+    elif hot == 1:
+        lead_type = "WARM"
+    else:
+        lead_type = "COLD"
+
+    intent = INFO_INTENTS[rank] if rank is not None else None
+
+    return Intent(intent, lead_type, warm)
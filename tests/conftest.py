@@ -0,0 +1,105 @@
+# Shared setup for the app5 tests:
+#
+#   python -m pytest tests
+#
+# app5 is imported once with START_BACKGROUND_SERVICES=0 (no threads, no
+# Google connection) against a temporary SQLite file. Each test gets its
+# own fake "Gym leads" worksheet (benchmarks/bench_e2e.py's FakeWorksheet),
+# lead index, lead store and sheet mirror, swapped in for app5's globals.
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+os.environ.update({
+    "START_BACKGROUND_SERVICES": "0",
+    "DATA_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="app5-tests-"), "leads.db"),
+    "LEAD_STORE": "sqlite",
+    "OWNER_NOTIFY_MODE": "digest",
+    "OWNER_NUMBER": "919900000000",
+    "GUPSHUP_API_KEY": "test",
+    "LOG_LEVEL": "WARNING",
+    "SHEETS_READS_PER_MINUTE": "100000",
+    "SHEETS_WRITES_PER_MINUTE": "100000",
+})
+
+import app5
+from bench_e2e import FakeGupshupAdapter, FakeSpreadsheet, FakeWorksheet, build_sheet
+
+# Nothing leaves the machine
+gupshup_adapter = FakeGupshupAdapter(0, 0)
+app5.gupshup.session.mount("https://", gupshup_adapter)
+
+# There is no warm-up without background services; the store is usable
+app5.services_ready.set()
+
+
+def make_index(worksheet):
+    # A second gunicorn worker's view of the same sheet
+    index = app5.LeadIndex(app5.InstrumentedWorksheet(lambda: worksheet))
+    index.refresh()
+    return index
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "leads.db")
+
+
+@pytest.fixture
+def worksheet():
+    ws = FakeWorksheet(build_sheet(3), 0, 0, 0)
+    FakeSpreadsheet(ws)
+    return ws
+
+
+@pytest.fixture
+def lead_index(worksheet, monkeypatch):
+    instrumented = app5.InstrumentedWorksheet(lambda: worksheet)
+    index = app5.LeadIndex(instrumented)
+    index.refresh()
+
+    monkeypatch.setattr(app5, "sheet", instrumented)
+    monkeypatch.setattr(app5, "lead_index", index)
+    return index
+
+
+@pytest.fixture
+def sheet_rows(db_path, monkeypatch):
+    claims = app5.SheetRowClaims(db_path, app5.SHEET_APPEND_CLAIM_SECONDS)
+    monkeypatch.setattr(app5, "sheet_rows", claims)
+    return claims
+
+
+@pytest.fixture
+def mirror(lead_index, sheet_rows):
+    return app5.SheetMirror(app5.SHEET_MIRROR_INTERVAL)
+
+
+@pytest.fixture
+def lead_store(db_path, mirror, monkeypatch):
+    store = app5.SqliteLeadStore(db_path, mirror)
+    monkeypatch.setattr(app5, "lead_store", store)
+    monkeypatch.setattr(app5, "sheet_mirror", mirror)
+    return store
+
+
+@pytest.fixture
+def session_store(db_path, monkeypatch):
+    store = app5.SqliteSessionStore(db_path, app5.SESSION_TTL)
+    monkeypatch.setattr(app5, "session_store", store)
+    return store
+
+
+def lead_row(phone, **fields):
+    values = [""] * app5.LEAD_COLUMNS
+    values[app5.COL_PHONE - 1] = phone
+    for field, value in fields.items():
+        values[app5.LEAD_FIELDS.index(field)] = value
+    return values
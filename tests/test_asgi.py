@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import pytest
+
+import app5
+import asgi
+from bench_e2e import webhook
+
+
+def call(method, path, body=b"", headers=()):
+    # One request through the ASGI app; returns (status, headers, body)
+    sent = []
+    chunks = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return chunks.pop(0) if chunks else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": list(headers)}
+    asyncio.run(asgi.app(scope, receive, send))
+
+    start, response = sent
+    return start["status"], dict(start["headers"]), response["body"]
+
+
+@pytest.fixture
+def queued(lead_store, session_store, db_path, monkeypatch):
+    jobs = []
+    monkeypatch.setattr(app5, "inbound_queue", app5.InboundQueue(db_path))
+    monkeypatch.setattr(app5.inbound, "submit", lambda key, fn, *args: jobs.append(key))
+    return jobs
+
+
+def test_webhook_is_acked_and_queued(queued):
+    status, _, body = call("POST", "/gupshup-webhook", json.dumps(webhook("919811111111", "hi")).encode())
+
+    assert (status, body) == (200, b"OK")
+    assert queued == ["919811111111"]
+    assert app5.inbound_queue.take("919811111111") == ("hi", None)
+
+
+def test_chat_replies_and_sets_the_session_cookie(queued):
+    session = "asgi-visitor-0001"
+    status, headers, body = call("POST", "/chat", json.dumps({"message": "hi", "session": session}).encode())
+
+    assert status == 200
+    assert json.loads(body) == {"reply": app5.WELCOME_TEXT, "session": session}
+    assert headers[b"set-cookie"].startswith(f"{app5.CHAT_SESSION_COOKIE}={session}".encode())
+    assert headers[b"access-control-allow-origin"] == b"*"
+
+
+def test_chat_session_comes_from_the_cookie(queued):
+    session = "asgi-visitor-0002"
+    cookie = f"{app5.CHAT_SESSION_COOKIE}={session}".encode()
+
+    _, _, body = call("POST", "/chat", json.dumps({"message": "hi"}).encode(), [(b"cookie", cookie)])
+
+    assert json.loads(body)["session"] == session
+
+
+def test_ready_and_unknown_routes():
+    assert call("GET", "/ready")[0] == 200
+    assert call("OPTIONS", "/chat")[0] == 200
+    assert call("GET", "/gupshup-webhook")[0] == 405
+    assert call("GET", "/nowhere")[0] == 404
+
+
+def test_large_body_is_refused(monkeypatch):
+    monkeypatch.setattr(asgi, "ASGI_MAX_BODY", 10)
+
+    assert call("POST", "/chat", b'{"message": "far too long"}')[0] == 413
@@ -0,0 +1,70 @@
+import json
+import threading
+
+import pytest
+
+import app5
+from conftest import lead_row
+
+
+@pytest.fixture
+def sends(lead_store, db_path, monkeypatch):
+    monkeypatch.setattr(app5, "campaign_log", app5.CampaignLog(db_path))
+    sent = []
+    failing = set()
+    lock = threading.Lock()
+
+    def send_template(phone, template_id, params):
+        with lock:
+            sent.append((phone, params))
+        status = "error" if phone in failing else "submitted"
+        return json.dumps({"status": status, "messageId": f"m-{phone}"})
+
+    monkeypatch.setattr(app5, "gupshup_send_template", send_template)
+
+    lead_store.insert("911", lead_row("911", name="Asha", lead_type="WARM"))
+    lead_store.insert("912", lead_row("912", name="Ravi", lead_type="HOT"))
+    lead_store.insert("913", lead_row("913", name="Neha", lead_type="WARM"))
+    lead_store.insert(app5.WEB_LEAD_PREFIX + "abc", lead_row(app5.WEB_LEAD_PREFIX + "abc", lead_type="WARM"))
+    return sent, failing
+
+
+def run(**kwargs):
+    return app5.run_campaign("offer", "tmpl", {"lead_type": "warm"}, ["{name}"], rate=1000, **kwargs)
+
+
+def test_campaign_sends_to_the_segment(sends):
+    sent, _ = sends
+
+    assert run() == {"sent": 2, "failed": 0, "skipped": 0}
+    assert sorted(sent) == [("911", ["Asha"]), ("913", ["Neha"])]
+    assert app5.campaign_log.counts("offer") == {"sent": 2}
+
+
+def test_resume_retries_only_failed_sends(sends):
+    sent, failing = sends
+    failing.add("913")
+
+    assert run() == {"sent": 1, "failed": 1, "skipped": 0}
+
+    failing.clear()
+    sent.clear()
+
+    assert run() == {"sent": 1, "failed": 0, "skipped": 1}
+    assert sent == [("913", ["Neha"])]
+
+
+def test_interrupted_send_is_not_repeated(sends):
+    sent, _ = sends
+    app5.campaign_log.mark("offer", "911", "sending")
+
+    assert run() == {"sent": 1, "failed": 0, "skipped": 1}
+    assert [phone for phone, _ in sent] == ["913"]
+
+
+def test_delivery_events_update_the_log(sends):
+    run()
+    app5.campaign_log.record_event("m-911", "delivered")
+    app5.campaign_log.record_event("m-913", "failed")
+
+    assert app5.campaign_log.counts("offer") == {"delivered": 1, "failed": 1}
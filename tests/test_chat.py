@@ -0,0 +1,54 @@
+import pytest
+
+import app5
+
+# Session ids are 16-64 url-safe characters
+ONE = "visitor-one-0001"
+TWO = "visitor-two-0002"
+BROWSING = "visitor-browsing"
+BOOKING = "visitor-booking1"
+
+
+@pytest.fixture
+def client(lead_store, session_store):
+    return app5.app.test_client()
+
+
+def web_lead(session):
+    return app5.lead_store.get(app5.WEB_LEAD_PREFIX + session)
+
+
+def test_visitors_keep_their_own_conversation(client):
+    one = client.post("/chat", json={"message": "hi", "session": ONE}).get_json()
+    two = client.post("/chat", json={"message": "hi", "session": TWO}).get_json()
+    assert (one["session"], two["session"]) == (ONE, TWO)
+
+    client.post("/chat", json={"message": "Free Trial", "session": ONE})
+
+    assert app5.session_store.get(app5.WEB_LEAD_PREFIX + ONE) == "ASK_NAME"
+    assert app5.session_store.get(app5.WEB_LEAD_PREFIX + TWO) is None
+
+
+def test_session_cookie_is_set_and_reused(client):
+    first = client.post("/chat", json={"message": "hi"})
+    session = first.get_json()["session"]
+
+    assert app5.CHAT_SESSION_COOKIE in first.headers["Set-Cookie"]
+    assert client.post("/chat", json={"message": "hi"}).get_json()["session"] == session
+
+
+def test_web_lead_is_saved_only_with_a_name_or_trial(client):
+    client.post("/chat", json={"message": "what is the fees", "session": BROWSING})
+    assert web_lead(BROWSING) is None
+
+    client.post("/chat", json={"message": "Free Trial", "session": BOOKING})
+    client.post("/chat", json={"message": "my name is asha", "session": BOOKING})
+
+    assert web_lead(BOOKING)[app5.COL_NAME - 1] == "Asha"
+
+
+def test_missing_message_is_rejected(client):
+    response = client.post("/chat", json={"text": "hi"})
+
+    assert response.status_code == 400
+    assert "Set-Cookie" not in response.headers
@@ -0,0 +1,17 @@
+import app5
+
+
+def test_sends_are_not_retried_after_gateway_errors():
+    client = app5.GupshupClient("key", "919911426467", "app")
+    retry = client.session.get_adapter("https://api.gupshup.io").max_retries
+
+    assert set(retry.status_forcelist) == {429, 503}
+    assert retry.read == 0
+
+
+def test_send_message_posts_to_the_pooled_session():
+    r = app5.gupshup.send_message("+91 98111 11111", {"type": "text", "text": "hi"})
+
+    assert r.status_code == 202
+    assert app5.gupshup_accepted(r.text)
+    assert "destination=919811111111" in r.request.body
@@ -0,0 +1,77 @@
+import pytest
+
+import app5
+from conftest import lead_row
+
+PHONE = "919811111111"
+
+
+@pytest.fixture
+def turn(lead_store, session_store):
+    def send(text, button=None):
+        return app5.process_message(PHONE, text, button_id=button)
+    return send
+
+
+def lead(field):
+    return app5.lead_store.get(PHONE)[app5.LEAD_FIELDS.index(field)]
+
+
+def test_lead_row_is_read_once_per_turn(turn, lead_store, monkeypatch):
+    lead_store.insert(PHONE, lead_row(PHONE, name="Asha"))
+    reads = []
+    get = lead_store.get
+    monkeypatch.setattr(lead_store, "get", lambda phone: reads.append(phone) or get(phone))
+
+    turn("what is the fees")
+
+    assert reads == [PHONE]
+
+
+def test_update_only_writes_the_given_fields(lead_store, session_store):
+    lead_store.insert(PHONE, lead_row(PHONE, name="Asha", interest="Free Trial", lead_type="HOT"))
+
+    context = app5.LeadContext.load(PHONE)
+    context.update(last_message="ok")
+    assert context.dirty == {app5.COL_LAST_MESSAGE, app5.COL_TIMESTAMP}
+    context.save()
+
+    assert lead("name") == "Asha"
+    assert lead("interest") == "Free Trial"
+    assert lead("lead_type") == "HOT"
+    assert lead("last_message") == "ok"
+
+
+def test_trial_booking_and_confirmation(turn, session_store, monkeypatch):
+    queued = []
+    monkeypatch.setattr(app5, "queue_reminder", lambda phone, kind, due: queued.append(kind))
+
+    assert turn("Free Trial", "TRIAL")["text"].startswith("Great!")
+    assert session_store.get(PHONE) == "ASK_NAME"
+
+    assert turn("my name is asha verma") == {"type": "trial_buttons", "name": "Asha Verma"}
+    assert session_store.get(PHONE) == "ASK_VISIT_TIME"
+    assert lead("interest") == "Free Trial"
+
+    assert turn("next month")["text"] == "⚠️ Please select from given buttons."
+
+    assert turn("Tomorrow", "visit_tomorrow")["text"].startswith("✅ Thanks!")
+    assert session_store.get(PHONE) is None
+    assert lead("trial_status") == "Trial booked - Tomorrow"
+    assert lead("lead_type") == "HOT"
+    assert (lead("reminder_sent"), lead("review_sent")) == ("NO", "NO")
+    assert queued == ["reminder", "review"]
+
+    assert turn("yes")["text"].startswith("✅ Great!")
+    assert lead("trial_status") == "Trial Confirmed"
+
+
+def test_yes_without_a_booking(turn):
+    assert turn("yes")["text"] == "🙂 Please type MENU to see options."
+
+
+def test_info_replies(turn):
+    assert turn("hi") == {"type": "menu"}
+    assert turn("what is the fees")["text"] == app5.FEES_TEXT
+    assert turn("Gym Photos", "GYM_PHOTOS") == {"type": "gym_images"}
+    assert turn("blah")["text"].startswith("⚠️ Please select a valid option.")
@@ -0,0 +1,43 @@
+import app5
+
+
+def test_sender_messages_are_handled_oldest_first(db_path, monkeypatch):
+    monkeypatch.setattr(app5, "inbound_queue", app5.InboundQueue(db_path))
+    handled = []
+    replies = []
+
+    monkeypatch.setattr(app5, "process_message", lambda sender, text, button_id=None: handled.append(text) or text)
+    monkeypatch.setattr(app5, "send_reply", lambda sender, result: replies.append(result))
+
+    for text in ("hi", "fees", "timings"):
+        app5.inbound_queue.add("911", text, None)
+    app5.inbound_queue.add("912", "other", None)
+
+    app5.handle_inbound("911")
+
+    assert handled == replies == ["hi", "fees", "timings"]
+    assert app5.inbound_queue.senders() == ["912"]
+
+    # A second run (another worker's job for the same messages) finds nothing
+    app5.handle_inbound("911")
+    assert handled == ["hi", "fees", "timings"]
+
+
+def test_failed_message_does_not_stop_the_rest(db_path, monkeypatch):
+    monkeypatch.setattr(app5, "inbound_queue", app5.InboundQueue(db_path))
+    replies = []
+
+    def process(sender, text, button_id=None):
+        if text == "bad":
+            raise RuntimeError("boom")
+        return text
+
+    monkeypatch.setattr(app5, "process_message", process)
+    monkeypatch.setattr(app5, "send_reply", lambda sender, result: replies.append(result))
+
+    for text in ("bad", "fees"):
+        app5.inbound_queue.add("911", text, None)
+    app5.handle_inbound("911")
+
+    assert replies == ["fees"]
+    assert app5.inbound_queue.senders() == []
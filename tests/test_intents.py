@@ -0,0 +1,26 @@
+from intents import classify_message
+
+
+def test_keywords_inside_other_words_do_not_match():
+    assert classify_message("can i come sometime") == (None, "COLD", False)
+    assert classify_message("thanks for the feedback") == (None, "COLD", False)
+    assert classify_message("is it somewhere near") == (None, "COLD", False)
+
+
+def test_button_ids_are_split_into_words():
+    assert classify_message("gym_photos").intent == "photos"
+    assert classify_message("visit_today") == (None, "WARM", False)
+
+
+def test_info_intent_priority():
+    assert classify_message("timings aur fees bata do").intent == "fees"
+    assert classify_message("where is it and what time").intent == "timings"
+    assert classify_message("send photos and results").intent == "photos"
+
+
+def test_lead_score():
+    assert classify_message("fees") == ("fees", "WARM", True)
+    assert classify_message("fee") == ("fees", "COLD", False)
+    assert classify_message("timing") == ("timings", "WARM", False)
+    assert classify_message("i want to join and book a trial") == (None, "HOT", False)
+    assert classify_message("just checking the fees and timings") == ("fees", "COLD", True)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import app5
+
+
+def test_lookups_do_not_wait_for_a_background_refresh(worksheet, lead_index):
+    phone = worksheet.rows[2][0]
+    lead_index.loaded_at = 1      # due for a full refresh
+    worksheet.latency = 0.5
+
+    refresh = threading.Thread(target=lead_index.sync)
+    refresh.start()
+    time.sleep(0.1)
+
+    started = time.perf_counter()
+    row = lead_index.find(phone)
+    values = lead_index.row_values(row)
+    elapsed = time.perf_counter() - started
+    refresh.join()
+
+    assert row == 3
+    assert values[0] == phone
+    assert elapsed < 0.2
+
+
+def test_local_write_during_refresh_is_kept(worksheet, lead_index):
+    lead_index.loaded_at = 1
+    worksheet.latency = 0.3
+
+    refresh = threading.Thread(target=lead_index.sync)
+    refresh.start()
+    time.sleep(0.1)
+
+    # Buffered, so the sheet only has it after the download was taken
+    with app5.sheet_write_batch():
+        lead_index.update_cell(2, app5.COL_NAME, "Local")
+        worksheet.latency = 0
+        refresh.join()
+
+    assert lead_index.row_values(2)[app5.COL_NAME - 1] == "Local"
+    assert worksheet.rows[1][app5.COL_NAME - 1] == "Local"
+
+
+def test_owner_edit_is_picked_up_by_sync(worksheet, lead_index):
+    lead_index.sync()    # rows first loaded
+    worksheet.rows[1][app5.COL_NAME - 1] = "Edited"
+    worksheet.version += 1
+
+    changes = lead_index.sync()
+
+    assert [(row, new[app5.COL_NAME - 1]) for row, _, new in changes] == [(2, "Edited")]
+    assert lead_index.sync() == []
+
+
+def test_deleted_row_is_picked_up_by_sync(worksheet, lead_index):
+    lead_index.sync()
+    deleted, moved = worksheet.rows[1][0], worksheet.rows[2][0]
+    del worksheet.rows[1]
+    worksheet.version += 1
+
+    lead_index.sync()
+
+    assert lead_index.find(moved) == 2
+    assert lead_index.find(deleted) is None
+    assert lead_index.row_values(2)[0] == moved
+
+
+def test_appended_rows_do_not_reload_the_sheet(worksheet, lead_index):
+    lead_index.sync()
+    worksheet.rows.append(["919855555555", "New"] + [""] * 11)
+    worksheet.version += 1
+    downloads = worksheet.calls["get_all_values"]
+
+    lead_index.sync()
+
+    assert lead_index.find("919855555555") == len(worksheet.rows)
+    assert worksheet.calls["get_all_values"] == downloads
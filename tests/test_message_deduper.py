@@ -0,0 +1,40 @@
+import time
+
+import app5
+
+
+def test_repeated_id_is_a_duplicate(db_path):
+    deduper = app5.MessageDeduper(db_path, ttl=60, max_entries=100)
+
+    assert deduper.is_duplicate("m1") is False
+    assert deduper.is_duplicate("m1") is True
+    assert deduper.is_duplicate("m2") is False
+
+
+def test_id_is_forgotten_after_ttl(db_path):
+    deduper = app5.MessageDeduper(db_path, ttl=0.05, max_entries=100)
+
+    assert deduper.is_duplicate("m1") is False
+    time.sleep(0.1)
+    assert deduper.is_duplicate("m1") is False
+    assert deduper.is_duplicate("m1") is True
+
+
+def test_workers_share_seen_ids(db_path):
+    one = app5.MessageDeduper(db_path, ttl=60, max_entries=100)
+    other = app5.MessageDeduper(db_path, ttl=60, max_entries=100)
+
+    assert one.is_duplicate("m1") is False
+    assert other.is_duplicate("m1") is True
+
+
+def test_evict_keeps_the_newest_entries(db_path):
+    deduper = app5.MessageDeduper(db_path, ttl=60, max_entries=2)
+
+    for message_id in ("m1", "m2", "m3"):
+        deduper.is_duplicate(message_id)
+        time.sleep(0.01)
+    deduper.evict()
+
+    assert deduper.is_duplicate("m1") is False
+    assert deduper.is_duplicate("m3") is True
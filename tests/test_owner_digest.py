@@ -0,0 +1,51 @@
+import pytest
+
+import app5
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    texts = []
+    monkeypatch.setattr(app5, "notify_owner", texts.append)
+    return texts
+
+
+def test_events_are_held_until_the_threshold(db_path, sent):
+    digest = app5.OwnerDigest(db_path, max_events=3)
+
+    digest.add("911", "hi", "COLD")
+    digest.add("912", "fees", "HOT")
+    assert sent == []
+
+    digest.add("911", "timings", "WARM")
+
+    assert len(sent) == 1
+    assert "3 message(s) from 2 lead(s)" in sent[0]
+    assert "📱 911 (2) 🔥 WARM\n💬 timings" in sent[0]
+    assert "📱 912 (1) 🔥 HOT\n💬 fees" in sent[0]
+
+
+def test_digest_is_sent_once_across_workers(db_path, sent):
+    one = app5.OwnerDigest(db_path, max_events=100)
+    other = app5.OwnerDigest(db_path, max_events=100)
+
+    one.add("911", "hi", "COLD")
+    other.add("912", "hi", "COLD")
+    one.flush()
+    other.flush()
+
+    assert len(sent) == 1
+    assert "2 message(s) from 2 lead(s)" in sent[0]
+
+
+def test_long_digest_is_cut_short(db_path, sent, monkeypatch):
+    monkeypatch.setattr(app5, "OWNER_DIGEST_MAX_LEADS", 2)
+    digest = app5.OwnerDigest(db_path, max_events=100)
+
+    for phone in ("911", "912", "913"):
+        digest.add(phone, "x" * 100, "COLD")
+    digest.flush()
+
+    assert sent[0].count("📱") == 2
+    assert "x" * 77 + "..." in sent[0]
+    assert sent[0].endswith("…and 1 more lead(s)")
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app5
+from conftest import lead_row
+
+
+@pytest.fixture
+def scheduler():
+    return app5.ReminderScheduler()
+
+
+def test_rebooked_trial_replaces_the_old_job(scheduler):
+    past = datetime.now() - timedelta(minutes=1)
+    later = datetime.now() + timedelta(hours=1)
+
+    scheduler.schedule("911", "reminder", past)
+    scheduler.schedule("911", "reminder", later)
+
+    assert scheduler.pop_due() == []
+    assert scheduler.jobs == {("911", "reminder"): later.timestamp()}
+
+
+def test_cancelled_job_is_skipped(scheduler):
+    scheduler.schedule("911", "review", datetime.now() - timedelta(minutes=1))
+    scheduler.cancel("911", "review")
+
+    assert scheduler.pop_due() == []
+
+
+def test_due_jobs_come_out_in_due_order(scheduler):
+    now = datetime.now()
+    scheduler.schedule("912", "reminder", now - timedelta(minutes=1))
+    scheduler.schedule("911", "reminder", now - timedelta(minutes=5))
+    scheduler.schedule("913", "reminder", now + timedelta(hours=1))
+
+    assert [phone for _, phone, _ in scheduler.pop_due()] == ["911", "912"]
+    assert list(scheduler.jobs) == [("913", "reminder")]
+
+
+def test_rebuild_loads_unsent_jobs_from_the_store(scheduler, lead_store):
+    lead_store.insert("911", lead_row("911", reminder_time="2026-01-01 09:00", reminder_sent="NO"))
+    lead_store.insert("912", lead_row("912", reminder_time="2026-01-01 09:00", reminder_sent="YES"))
+    lead_store.insert("913", lead_row("913", reminder_time="tomorrow", reminder_sent="NO"))
+
+    scheduler.rebuild()
+
+    assert scheduler.jobs == {("911", "reminder"): datetime(2026, 1, 1, 9, 0).timestamp()}
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app5
+from conftest import lead_row
+
+
+@pytest.fixture
+def reminders(lead_store, monkeypatch):
+    monkeypatch.setattr(app5, "reminder_scheduler", app5.ReminderScheduler())
+    monkeypatch.setattr(app5, "sent_flags", app5.SentFlags())
+    return app5.reminder_scheduler
+
+
+def test_retry_gives_up_after_max_attempts(reminders):
+    results = [reminders.retry("911", "reminder") for _ in range(app5.REMINDER_MAX_ATTEMPTS)]
+
+    assert results == [True] * (app5.REMINDER_MAX_ATTEMPTS - 1) + [False]
+
+
+def test_claim_skips_sent_and_flagged_jobs(reminders, lead_store):
+    lead_store.insert("911", lead_row("911", name="A", reminder_sent="NO"))
+    lead_store.insert("912", lead_row("912", name="B", reminder_sent="YES"))
+    lead_store.insert("913", lead_row("913", name="C", reminder_sent="NO"))
+    app5.sent_flags.add("913", app5.COL_REMINDER_SENT)
+
+    due = [(0, "911", "reminder"), (0, "912", "reminder"), (0, "913", "reminder"), (0, "914", "reminder")]
+
+    assert app5.claim_due_jobs(due) == [("911", "reminder", "A")]
+
+
+def test_sent_flags_are_saved_in_one_batch(reminders, lead_store, monkeypatch):
+    for phone in ("911", "912", "913"):
+        lead_store.insert(phone, lead_row(phone, name=phone, reminder_sent="NO"))
+        reminders.schedule(phone, "reminder", datetime.now() - timedelta(minutes=1))
+
+    monkeypatch.setattr(app5, "send_due_job", lambda phone, kind, name: phone != "913")
+    batches = []
+    update_many = lead_store.update_many
+    monkeypatch.setattr(lead_store, "update_many", lambda changes: batches.append(dict(changes)) or update_many(changes))
+
+    app5.reminder_checker()
+
+    assert batches == [{"911": {app5.COL_REMINDER_SENT: "YES"}, "912": {app5.COL_REMINDER_SENT: "YES"}}]
+    assert lead_store.get("913")[app5.COL_REMINDER_SENT - 1] == "NO"
+    assert list(reminders.jobs) == [("913", "reminder")]
+
+
+def test_unsaved_flags_stop_a_resend(reminders, lead_store, monkeypatch):
+    lead_store.insert("911", lead_row("911", name="A", reminder_sent="NO"))
+    app5.sent_flags.add("911", app5.COL_REMINDER_SENT)
+    update_many = lead_store.update_many
+
+    def failing(changes):
+        raise RuntimeError("locked")
+
+    monkeypatch.setattr(lead_store, "update_many", failing)
+    app5.sent_flags.flush()
+
+    assert app5.claim_due_jobs([(0, "911", "reminder")]) == []
+
+    monkeypatch.setattr(lead_store, "update_many", update_many)
+    app5.sent_flags.flush()
+
+    assert lead_store.get("911")[app5.COL_REMINDER_SENT - 1] == "YES"
@@ -0,0 +1,119 @@
+import time
+from datetime import datetime, timedelta
+
+import app5
+from bench_e2e import quota_error
+from conftest import lead_row
+
+
+def scored(age_days=0.0, in_flow=(), **fields):
+    stamp = datetime.now() - timedelta(days=age_days, minutes=1)
+    row = lead_row("911", timestamp=stamp.strftime("%d-%m-%Y %H:%M"), **fields)
+    return app5.score_leads([row], time.time(), frozenset(in_flow))[0]
+
+
+def test_recent_hot_message_stays_hot():
+    assert scored(last_message="what is the fees and membership price") == "HOT"
+
+
+def test_lead_mid_booking_is_hot():
+    assert scored(last_message="Rahul", interest="Free Trial") == "HOT"
+    assert scored(last_message="Rahul", in_flow={"911"}) == "HOT"
+
+
+def test_recent_lead_is_not_scored_below_its_type():
+    assert scored(last_message="hi", lead_type="HOT") == "HOT"
+
+
+def test_quiet_leads_cool_down():
+    assert scored(age_days=3, last_message="what is the fees and membership price", lead_type="HOT") == "WARM"
+    assert scored(age_days=40, last_message="what is the fees and membership price", lead_type="HOT") == "COLD"
+
+
+def test_rescore_leads_writes_changed_types(lead_store, session_store):
+    old = (datetime.now() - timedelta(days=40)).strftime("%d-%m-%Y %H:%M")
+    lead_store.insert("911", lead_row("911", lead_type="HOT", last_message="fees", timestamp=old))
+    lead_store.insert("912", lead_row("912", lead_type="HOT", last_message="fees", timestamp=app5.now_str()))
+
+    result = app5.rescore_leads()
+
+    assert result["changed"] == result["applied"] == 1
+    assert lead_store.get("911")[app5.COL_LEAD_TYPE - 1] == "COLD"
+    assert lead_store.get("912")[app5.COL_LEAD_TYPE - 1] == "HOT"
+
+
+def test_update_lead_types_applies_to_unchanged_leads(lead_store, mirror):
+    row = lead_row("919811111111", lead_type="HOT", last_message="hi", timestamp="01-01-2026 10:00")
+    lead_store.insert("919811111111", row)
+    mirror.pending.clear()
+
+    assert lead_store.update_lead_types({"919811111111": (row, "COLD")}) == 1
+    assert lead_store.get("919811111111")[app5.COL_LEAD_TYPE - 1] == "COLD"
+    assert mirror.pending == {"919811111111": {app5.COL_LEAD_TYPE: "COLD"}}
+
+
+def test_update_lead_types_skips_a_lead_that_messaged_meanwhile(lead_store, session_store):
+    phone = "919811111111"
+    app5.process_message(phone, "hi")
+    app5.lead_store.update(phone, {app5.COL_TIMESTAMP: "01-01-2026 10:00"})
+
+    scored = lead_store.get(phone)
+    assert app5.score_leads([app5.lead_cells(scored)], app5.time.time()) == ["COLD"]
+
+    # The lead writes in while the batch runs; the type stays HOT either way
+    app5.process_message(phone, "what is the fees and membership price")
+    assert lead_store.get(phone)[app5.COL_LEAD_TYPE - 1] == "HOT"
+
+    assert lead_store.update_lead_types({phone: (scored, "COLD")}) == 0
+    assert lead_store.get(phone)[app5.COL_LEAD_TYPE - 1] == "HOT"
+
+
+def test_sheet_store_update_lead_types_skips_changed_rows(worksheet, lead_index):
+    store = app5.SheetLeadStore()
+    phone = worksheet.rows[1][0]
+    scored = lead_index.row_values(2)
+
+    worksheet.rows[1][app5.COL_LAST_MESSAGE - 1] = "fees"
+    worksheet.rows[1][app5.COL_LEAD_TYPE - 1] = "HOT"
+    lead_index.read_rows(2, 2)
+
+    assert store.update_lead_types({phone: (scored, "COLD")}) == 0
+    assert worksheet.rows[1][app5.COL_LEAD_TYPE - 1] == "HOT"
+
+    scored = lead_index.row_values(2)
+    assert store.update_lead_types({phone: (scored, "WARM")}) == 1
+    assert worksheet.rows[1][app5.COL_LEAD_TYPE - 1] == "WARM"
+
+
+def test_sheet_store_writes_one_shard_at_a_time(worksheet, lead_index, monkeypatch):
+    store = app5.SheetLeadStore()
+    changes = {row[0]: (lead_index.row_values(i + 2), "COLD") for i, row in enumerate(worksheet.rows[1:])}
+    shards = {app5.sender_locks.shard_of(phone) for phone in changes}
+
+    held = []
+    batch_update = worksheet.batch_update
+
+    def recording(data, *args, **kwargs):
+        held.append([i for i, lock in enumerate(app5.sender_locks.locks) if lock.locked()])
+        return batch_update(data, *args, **kwargs)
+
+    monkeypatch.setattr(worksheet, "batch_update", recording)
+
+    assert store.update_lead_types(changes) == len(changes)
+    assert held == [[shard] for shard in sorted(shards)]
+    assert all(row[app5.COL_LEAD_TYPE - 1] == "COLD" for row in worksheet.rows[1:])
+
+
+def test_sheet_store_does_not_retry_while_holding_a_shard(worksheet, lead_index, monkeypatch):
+    store = app5.SheetLeadStore()
+    phone = worksheet.rows[1][0]
+    calls = []
+
+    def quota_exceeded(*args, **kwargs):
+        calls.append(1)
+        raise quota_error()
+
+    monkeypatch.setattr(worksheet, "batch_update", quota_exceeded)
+
+    assert store.update_lead_types({phone: (lead_index.row_values(2), "COLD")}) == 0
+    assert len(calls) == 1
@@ -0,0 +1,42 @@
+import app5
+from conftest import lead_row
+
+
+def test_sheet_edit_is_applied(lead_store):
+    old = lead_row("919811111111", name="Asha", lead_type="COLD")
+    new = lead_row("919811111111", name="Asha K", lead_type="COLD")
+    lead_store.insert("919811111111", old)
+
+    assert lead_store.apply_sheet_edits([(2, old, new)]) == 1
+    assert lead_store.get("919811111111")[app5.COL_NAME - 1] == "Asha K"
+
+
+def test_sheet_edit_does_not_overwrite_a_newer_local_value(lead_store):
+    old = lead_row("919811111111", name="Asha")
+    new = lead_row("919811111111", name="Asha K")
+    lead_store.insert("919811111111", old)
+    lead_store.update("919811111111", {app5.COL_NAME: "Asha Kumari"})
+
+    # The sheet row predates the local change
+    assert lead_store.apply_sheet_edits([(2, old, new)]) == 0
+    assert lead_store.get("919811111111")[app5.COL_NAME - 1] == "Asha Kumari"
+
+
+def test_lead_typed_into_the_sheet_is_inserted(lead_store):
+    new = lead_row("+91 98111 33333", name="Walk-in")
+
+    assert lead_store.apply_sheet_edits([(9, [], new)]) == 1
+    assert lead_store.get("919811133333")[app5.COL_NAME - 1] == "Walk-in"
+
+
+
+def test_owner_edit_reaches_the_store_through_sync(worksheet, lead_index, lead_store):
+    lead_store.import_rows(lead_index.snapshot(refresh=True)[1:])
+    lead_index.sync()
+    phone = worksheet.rows[2][0]
+    worksheet.rows[2][app5.COL_TRIAL_STATUS - 1] = "Joined"
+    worksheet.version += 1
+
+    app5.sync_sheet()
+
+    assert lead_store.get(phone)[app5.COL_TRIAL_STATUS - 1] == "Joined"
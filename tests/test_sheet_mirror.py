@@ -0,0 +1,123 @@
+import time
+
+import app5
+from bench_e2e import quota_error
+from conftest import lead_row, make_index
+
+
+def phone_rows(worksheet, phone):
+    return [r for r in worksheet.rows if r and r[0] == phone]
+
+
+def test_new_lead_is_appended(worksheet, lead_store, mirror):
+    lead_store.insert("919811111111", lead_row("919811111111", name="Asha"))
+    mirror.flush()
+
+    assert phone_rows(worksheet, "919811111111") == [lead_row("919811111111", name="Asha")]
+    assert worksheet.calls.get("append_rows") == 1
+    assert mirror.pending == {}
+
+
+def test_existing_lead_is_updated_in_place(worksheet, lead_store, mirror):
+    phone = worksheet.rows[1][0]
+    lead_store.import_rows(worksheet.rows[1:])
+
+    lead_store.update(phone, {app5.COL_NAME: "Ravi", app5.COL_LAST_MESSAGE: "fees"})
+    lead_store.update(phone, {app5.COL_LAST_MESSAGE: "timings"})
+    mirror.flush()
+
+    assert worksheet.rows[1][app5.COL_NAME - 1] == "Ravi"
+    assert worksheet.rows[1][app5.COL_LAST_MESSAGE - 1] == "timings"
+    assert worksheet.calls.get("batch_update") == 1
+    assert "append_rows" not in worksheet.calls
+
+
+def test_two_workers_append_a_new_lead_once(worksheet, lead_index, lead_store, mirror, monkeypatch):
+    phone = "919999999999"
+    other_index = make_index(worksheet)
+    other_mirror = app5.SheetMirror(app5.SHEET_MIRROR_INTERVAL)
+
+    lead_store.insert(phone, lead_row(phone))
+    other_mirror.push(phone, {app5.COL_NAME: "Neha"})
+
+    mirror.flush()
+
+    # The other worker read the tail just before, so it has not seen the row
+    monkeypatch.setattr(app5, "lead_index", other_index)
+    other_index.tail_read_at = time.time()
+    other_mirror.flush()
+
+    assert len(phone_rows(worksheet, phone)) == 1
+    assert other_mirror.pending == {phone: {app5.COL_NAME: "Neha"}}
+
+    # Once the row reaches its index the change is written to it
+    other_index.tail_read_at = 0
+    other_mirror.flush()
+
+    assert phone_rows(worksheet, phone)[0][app5.COL_NAME - 1] == "Neha"
+    assert other_mirror.pending == {}
+
+
+def test_failed_append_is_retried_by_any_worker(worksheet, lead_store, mirror, monkeypatch):
+    phone = "919822222222"
+    append_rows = worksheet.append_rows
+
+    def failing(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(worksheet, "append_rows", failing)
+    lead_store.insert(phone, lead_row(phone))
+    mirror.flush()
+
+    assert phone in mirror.pending
+    assert app5.sheet_rows.claim([phone]) == [phone]
+    app5.sheet_rows.release([phone])
+
+    monkeypatch.setattr(worksheet, "append_rows", append_rows)
+    mirror.flush()
+
+    assert len(phone_rows(worksheet, phone)) == 1
+    assert mirror.pending == {}
+
+
+def test_stale_claim_is_taken_over(db_path):
+    claims = app5.SheetRowClaims(db_path, stale_after=0.05)
+
+    assert claims.claim(["911"]) == ["911"]
+    assert claims.claim(["911"]) == []
+
+    time.sleep(0.1)
+    assert claims.claim(["911"]) == ["911"]
+
+    claims.appended({"911": 7})
+    time.sleep(0.1)
+    assert claims.claim(["911"]) == []
+
+
+def test_failed_lookup_does_not_append_a_duplicate(worksheet, lead_index, lead_store, mirror, monkeypatch):
+    phone = worksheet.rows[2][0]
+    lead_store.import_rows(worksheet.rows[1:])
+    get_all_values = worksheet.get_all_values
+
+    def quota_exceeded(*args, **kwargs):
+        raise quota_error()
+
+    # The hourly refresh is due and Google answers it with a 429
+    monkeypatch.setattr(app5, "SHEETS_MAX_RETRIES", 0)
+    monkeypatch.setattr(worksheet, "get_all_values", quota_exceeded)
+    lead_index.loaded_at = 1
+
+    lead_store.update(phone, {app5.COL_NAME: "Updated"})
+    mirror.flush()
+
+    assert len(phone_rows(worksheet, phone)) == 1
+    assert mirror.pending == {phone: {app5.COL_NAME: "Updated"}}
+    assert mirror.failures == 1
+
+    monkeypatch.setattr(worksheet, "get_all_values", get_all_values)
+    mirror.flush()
+
+    assert phone_rows(worksheet, phone)[0][app5.COL_NAME - 1] == "Updated"
+    assert len(phone_rows(worksheet, phone)) == 1
+    assert mirror.pending == {}
+    assert mirror.failures == 0
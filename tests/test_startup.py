@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import app5
+from conftest import ROOT, lead_row
+
+PHONE = "919811111111"
+
+
+class InlineDispatcher:
+
+    def submit(self, key, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def warming_up(worksheet, lead_index, lead_store, session_store, db_path, monkeypatch):
+    worksheet.rows[1] = lead_row(PHONE, name="Asha", lead_type="HOT", trial_status="Trial booked - Tomorrow")
+
+    monkeypatch.setattr(app5, "services_ready", threading.Event())
+    monkeypatch.setattr(app5, "startup_status", dict(app5.startup_status))
+    monkeypatch.setattr(app5, "inbound_queue", app5.InboundQueue(db_path))
+    monkeypatch.setattr(app5, "inbound", InlineDispatcher())
+    monkeypatch.setattr(app5, "claim_scheduler", lambda: None)
+    monkeypatch.setattr(app5.scheduler, "add_job", lambda *args, **kwargs: None)
+
+    replies = []
+    monkeypatch.setattr(app5, "send_reply", lambda sender, result: replies.append(result["text"]))
+    return replies
+
+
+def lead(field):
+    return app5.lead_store.get(PHONE)[app5.LEAD_FIELDS.index(field)]
+
+
+def test_message_during_warm_up_waits_for_the_import(warming_up):
+    app5.inbound_queue.add(PHONE, "yes", None)
+    app5.handle_inbound(PHONE)
+
+    assert warming_up == []
+    assert app5.lead_store.get(PHONE) is None
+
+    app5.warm_up()
+
+    assert warming_up[0].startswith("✅ Great!")
+    assert lead("trial_status") == "Trial Confirmed"
+    assert lead("name") == "Asha"
+
+
+def test_lead_created_during_warm_up_is_merged_with_the_sheet(warming_up, worksheet, mirror):
+    app5.lead_store.insert(PHONE, lead_row(PHONE, lead_type="WARM", last_message="hi"))
+    mirror.pending.clear()
+
+    app5.warm_up()
+
+    assert app5.lead_store.is_imported()
+    assert lead("name") == "Asha"
+    assert lead("trial_status") == "Trial booked - Tomorrow"
+    assert lead("lead_type") == "HOT"
+    assert lead("last_message") == "hi"
+    assert mirror.pending == {PHONE: {app5.COL_LAST_MESSAGE: "hi"}}
+
+    # Other leads were imported as well
+    assert app5.lead_store.get(worksheet.rows[2][0]) is not None
+
+
+def test_chat_answers_503_while_warming_up(warming_up, monkeypatch):
+    monkeypatch.setattr(app5, "CHAT_READY_TIMEOUT", 0.01)
+
+    body, status = app5.handle_chat({"message": "hi"}, "abc")
+
+    assert status == 503
+    assert app5.lead_store.get(app5.WEB_LEAD_PREFIX + "abc") is None
+
+
+def test_import_without_background_services_starts_no_threads(tmp_path):
+    code = "import threading, app5; print(len(threading.enumerate()))"
+    env = dict(os.environ, START_BACKGROUND_SERVICES="0", DATA_DB_PATH=str(tmp_path / "leads.db"))
+
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+    assert out.stdout.strip().splitlines()[-1] == "1"
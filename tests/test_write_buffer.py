@@ -0,0 +1,40 @@
+import app5
+
+
+def test_adjacent_columns_share_one_range():
+    buffer = app5.SheetWriteBuffer(None)
+    buffer.add(5, 4, "HOT")
+    buffer.add(5, 6, "fees")
+    buffer.add(5, 7, "01-01-2026 10:00")
+    buffer.add(5, 4, "WARM")     # last write wins
+    buffer.add(2, 2, "Asha")
+
+    assert buffer.ranges() == [
+        {"range": "B2", "values": [["Asha"]]},
+        {"range": "D5", "values": [["WARM"]]},
+        {"range": "F5:G5", "values": [["fees", "01-01-2026 10:00"]]},
+    ]
+
+
+def test_flush_sends_one_batch_update(worksheet):
+    buffer = app5.SheetWriteBuffer(worksheet)
+    buffer.add(2, app5.COL_NAME, "Asha")
+    buffer.add(3, app5.COL_NAME, "Ravi")
+    buffer.flush()
+    buffer.flush()    # nothing left to send
+
+    assert worksheet.calls == {"batch_update": 1}
+    assert worksheet.rows[1][app5.COL_NAME - 1] == "Asha"
+    assert worksheet.rows[2][app5.COL_NAME - 1] == "Ravi"
+
+
+def test_turn_writes_are_batched(worksheet, lead_index):
+    with app5.sheet_write_batch():
+        lead_index.update_cell(2, app5.COL_NAME, "Asha")
+        lead_index.update_cell(2, app5.COL_LEAD_TYPE, "HOT")
+
+        assert worksheet.rows[1][app5.COL_NAME - 1] != "Asha"
+
+    assert worksheet.calls.get("batch_update") == 1
+    assert "update_cell" not in worksheet.calls
+    assert worksheet.rows[1][app5.COL_NAME - 1] == "Asha"